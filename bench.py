@@ -0,0 +1,224 @@
+# bench.py - Smarta - headless storage benchmarks for NotesStore / CommunityStore
+#
+#   python bench.py --scale small                       # 1k notes, quick check
+#   python bench.py --scale large --out bench.json      # 100k notes / 100k messages
+#   python bench.py --save-baseline bench_baseline.json
+#   python bench.py --baseline bench_baseline.json      # exit 1 on regression
+#
+# Each operation is warmed up, then timed over `--repeats` runs of many
+# samples (p50/p95/p99 are the median across runs, max the worst), with
+# bytes written (/proc/self/io wchar, or the growth of the data dir where
+# /proc is unavailable). Peak Python heap comes from a separate pass under
+# tracemalloc, so tracing never slows down the timed calls.
+import os
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import statistics
+import tracemalloc
+import main
+
+SCALES = {
+    "small":  {"notes": 1_000,   "folders": 10,  "messages": 10_000,  "posts": 10_000,  "attachment_mb": 8},
+    "medium": {"notes": 10_000,  "folders": 50,  "messages": 50_000,  "posts": 50_000,  "attachment_mb": 32},
+    "large":  {"notes": 100_000, "folders": 200, "messages": 100_000, "posts": 100_000, "attachment_mb": 128},
+}
+WORDS = ("cell membrane protein energy nurse patient heart blood lung study exam note chapter "
+         "summary anatomy photosynthesis enzyme vitamin dosage ward shift clinical theory").split()
+
+def text(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def bytes_written():
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(r, f)) for r, _, files in os.walk(path) for f in files)
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * pct / 100.0
+    lo = int(k); hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+def measure(name, fn, samples, data_dir, repeats=3, warmup=3, mem_samples=10):
+    # fn(i) runs one operation (every call gets a new i); returns a result dict for `name`
+    calls = iter(range(1 << 62))
+    for _ in range(warmup):
+        fn(next(calls))
+    main.flush_writes()
+    io0 = bytes_written(); size0 = dir_size(data_dir) if io0 is None else 0
+    runs = []
+    for _ in range(repeats):
+        times = []
+        for _ in range(samples):
+            i = next(calls); t = time.perf_counter()
+            fn(i)
+            times.append((time.perf_counter() - t) * 1000)
+        runs.append(sorted(times))
+    main.flush_writes()
+    io1 = bytes_written()
+    written = ((io1 - io0) if io0 is not None else max(dir_size(data_dir) - size0, 0)) // repeats
+    tracemalloc.start()
+    for _ in range(min(samples, mem_samples)):
+        fn(next(calls))
+    main.flush_writes()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    def pct(p):
+        return round(statistics.median(percentile(times, p) for times in runs), 4)
+    def spread(p):
+        vals = [percentile(times, p) for times in runs]
+        return round(max(vals) - min(vals), 4)
+    res = {"n": samples, "repeats": repeats, "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+           "max_ms": round(max(times[-1] for times in runs), 4), "peak_kb": round(peak / 1024, 1), "bytes_written": written,
+           "spread_ms": {"p50_ms": spread(50), "p95_ms": spread(95)}}
+    print(f"{name:<24}{res['p50_ms']:>10.3f}{res['p95_ms']:>10.3f}{res['p99_ms']:>10.3f}{res['max_ms']:>10.3f}"
+          f"{res['peak_kb']:>12.1f}{written / samples:>14.0f}", flush=True)
+    return res
+
+def populate(notes, communities, cfg, rng):
+    t = time.perf_counter()
+    folders = [f"Folder {i}" for i in range(cfg["folders"])]
+    per_folder = cfg["notes"] // len(folders)
+    for folder in folders:
+        notes.create_folder(folder)
+        batch = [{"id": main.new_id(), "title": text(rng, 4), "body": text(rng, 120),
+                  "created": main.datetime.utcnow().isoformat()} for _ in range(per_folder)]
+        notes.backend.insert_notes(folder, batch)
+        if notes.search_index is not None:
+            notes.search_index.index_docs([notes.index_entry(n["id"], n["title"], n["body"]) for n in batch])
+    communities.create_community("Busy")
+    log = communities.post_log("Busy")
+    log.append_many({"id": main.new_id(), "author": "bench", "text": text(rng, 30), "created": "2024-01-01T00:00:00",
+                     "attachment": None, "attachment_blob": None, "attachment_name": None} for _ in range(cfg["posts"]))
+    communities.message_log("Busy").append_many(
+        {"sender": "bench", "text": text(rng, 12), "created": "2024-01-01T00:00:00"} for _ in range(cfg["messages"]))
+    main.flush_writes()
+    print(f"dataset: {cfg['notes']} notes in {len(folders)} folders, {cfg['posts']} posts, "
+          f"{cfg['messages']} messages ({time.perf_counter() - t:.1f}s)\n")
+    return folders
+
+def run(scale, samples, data_dir, with_index=True, seed=1234, repeats=3):
+    cfg = SCALES[scale]
+    rng = random.Random(seed)
+    index = main.open_search_index(os.path.join(data_dir, "search.db")) if with_index else None
+    notes = main.NotesStore(data_dir, search_index=index)
+    communities = main.CommunityStore(data_dir, search_index=index)
+    folders = populate(notes, communities, cfg, rng)
+    big = os.path.join(data_dir, "..", "bench_attachment.bin")
+    with open(big, "wb") as f:
+        for _ in range(cfg["attachment_mb"]):
+            f.write(os.urandom(1024 * 1024))
+    ids = {f: [n["id"] for n in notes.list_notes(f, limit=200)] for f in folders[:20]}
+    def timed(name, fn, n, **kwargs):
+        return measure(name, fn, n, data_dir, repeats=repeats, **kwargs)
+    print(f"{'operation':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'peak KiB':>12}{'bytes/op':>14}")
+    results = {}
+    results["list_notes"] = timed("list_notes", lambda i: notes.list_notes(folders[i % len(folders)], limit=50), samples)
+    results["list_notes_all"] = timed("list_notes_all", lambda i: notes.list_notes(folders[i % len(folders)]), max(samples // 10, 20))
+    def load(i):
+        f = folders[i % 20 if len(folders) >= 20 else i % len(folders)]
+        notes.load_note(f, rng.choice(ids[f]))
+    results["load_note"] = timed("load_note", load, samples)
+    results["save_note"] = timed("save_note", lambda i: notes.save_note(folders[i % len(folders)], text(rng, 4), text(rng, 120)), samples)
+    names = {"cur": folders[-1]}
+    def rename(i):
+        new = f"Renamed {i}"
+        notes.rename_folder(names["cur"], new); names["cur"] = new
+    results["rename_folder"] = timed("rename_folder", rename, max(samples // 10, 20))
+    results["add_post"] = timed("add_post", lambda i: communities.add_post("Busy", "bench", text(rng, 30)), samples)
+    cursors = {"c": None}
+    def list_posts(i):
+        page = communities.list_posts("Busy", cursor=cursors["c"], limit=20)
+        cursors["c"] = page[-1]["seq"] if len(page) == 20 and i % 10 else None
+    results["list_posts"] = timed("list_posts", list_posts, samples)
+    results["add_message"] = timed("add_message", lambda i: communities.add_message("Busy", "bench", text(rng, 12)), samples)
+    results["list_messages"] = timed("list_messages", lambda i: communities.list_messages("Busy", limit=50), samples)
+    def add_attachment(i):
+        # new bytes and mtime each sample, so the blob store copies and hashes
+        # the whole file instead of hitting its (path, size, mtime) shortcut
+        with open(big, "r+b") as f:
+            f.write(i.to_bytes(8, "little") + os.urandom(8))
+        os.utime(big, ns=(time.time_ns(), time.time_ns() + i))
+        communities.add_post("Busy", "bench", "file", big)
+    results["add_post_attachment"] = timed("add_post_attachment", add_attachment, 3, warmup=1, mem_samples=1)
+    return results
+
+def compare(results, baseline, tolerance, slack_ms=0.2):
+    # slack_ms absorbs scheduler/fsync jitter on sub-millisecond operations;
+    # on top of that, the spread between repeats of either run is allowed
+    regressions = []
+    for op, base in baseline.get("results", {}).items():
+        cur = results.get(op)
+        if cur is None:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            noise = base.get("spread_ms", {}).get(key, 0) + cur.get("spread_ms", {}).get(key, 0)
+            limit = base[key] * (1 + tolerance) + slack_ms + noise
+            if cur[key] > limit:
+                regressions.append(f"{op}.{key}: {cur[key]:.3f} ms > {limit:.3f} ms (baseline {base[key]:.3f})")
+        if base.get("bytes_written") and cur["bytes_written"] > base["bytes_written"] * (1 + tolerance) + 4096:
+            regressions.append(f"{op}.bytes_written: {cur['bytes_written']} > baseline {base['bytes_written']}")
+    return regressions
+
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description="Headless Smarta storage benchmarks")
+    ap.add_argument("--scale", choices=sorted(SCALES), default="small")
+    ap.add_argument("--samples", type=int, default=200)
+    ap.add_argument("--repeats", type=int, default=3, help="timed runs per operation; percentiles are their median")
+    ap.add_argument("--no-index", action="store_true", help="benchmark stores without the search index")
+    ap.add_argument("--out", help="write results as JSON")
+    ap.add_argument("--baseline", help="compare against a saved result file; exit 1 on regression")
+    ap.add_argument("--save-baseline", help="write results as the new baseline")
+    ap.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown vs. baseline (0.5 = 50%%)")
+    ap.add_argument("--keep", action="store_true", help="keep the generated data dir")
+    args = ap.parse_args(argv)
+    work = tempfile.mkdtemp(prefix="smarta-bench-")
+    data_dir = os.path.join(work, "data")
+    try:
+        results = run(args.scale, args.samples, data_dir, with_index=not args.no_index, repeats=args.repeats)
+    finally:
+        main.flush_writes()
+        if args.keep:
+            print(f"\ndata kept in {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    doc = {"meta": {"scale": args.scale, "samples": args.samples, "repeats": args.repeats, "index": not args.no_index,
+                    "python": platform.python_version(), "machine": platform.machine(),
+                    "ts": main.datetime.utcnow().isoformat()}, "results": results}
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(doc, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("scale") != args.scale:
+            print(f"\nwarning: baseline scale {baseline.get('meta', {}).get('scale')} != {args.scale}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS vs. baseline:")
+            for r in regressions:
+                print("  " + r)
+            return 1
+        print("\nno regressions vs. baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
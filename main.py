@@ -1,21 +1,112 @@
 # main.py - Smarta (final) - single-file Kivy/KivyMD app scaffold
+import time
+STARTUP_T0 = time.perf_counter()
 import os
+import sys
+if '--profile-startup' in sys.argv:
+    # our own flags: keep Kivy's option parser from rejecting them
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+import atexit
 import shutil
+import hashlib
 import json
+import math
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
 from kivy.utils import platform
-from kivy.uix.filechooser import FileChooserIconView
-from kivy.uix.popup import Popup
+from kivy.clock import Clock
+from kivy.logger import Logger
 from kivy.uix.scrollview import ScrollView
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.textinput import TextInput
+from kivy.uix.image import Image
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivymd.app import MDApp
 from kivymd.uix.button import MDRaisedButton, MDFlatButton, MDIconButton
 from kivymd.uix.label import MDLabel
-from kivymd.uix.textfield import MDTextField
 from kivymd.uix.toolbar import MDTopAppBar
-from kivymd.uix.snackbar import Snackbar
-import requests
+STARTUP_IMPORTS_DONE = time.perf_counter()
+
+# ---------------- Deferred Imports ----------------
+# Dialog-only widgets are imported the first time one is opened, not at launch
+# (requests is imported by AIClient.session and Pillow by PreviewCache.build;
+# zipfile by NoteImporter, tarfile by BackupEngine, gzip by CommunitySync).
+def Popup(**kwargs):
+    from kivy.uix.popup import Popup as _Popup
+    return _Popup(**kwargs)
+
+def FileChooserIconView(**kwargs):
+    from kivy.uix.filechooser import FileChooserIconView as _FileChooserIconView
+    return _FileChooserIconView(**kwargs)
+
+def Snackbar(**kwargs):
+    from kivymd.uix.snackbar import Snackbar as _Snackbar
+    return _Snackbar(**kwargs)
+
+def MDTextField(**kwargs):
+    from kivymd.uix.textfield import MDTextField as _MDTextField
+    return _MDTextField(**kwargs)
+
+# ---------------- Startup Profiler ----------------
+STARTUP_LOG_BYTES = 256 * 1024
+
+class StartupProfiler:
+    # Per-phase startup timings (imports, stores, screen builds, first frame),
+    # in ms since the process started. Appended as one JSON line per launch to
+    # startup.log; `python main.py --profile-startup [--headless]` prints them.
+    def __init__(self, t0):
+        self.t0 = t0; self.last = t0
+        self.phases = []
+        self.done = False
+
+    def mark(self, name, at=None):
+        # records the time since the previous mark as phase `name`
+        if self.done:
+            return
+        now = at or time.perf_counter()
+        self.phases.append({"phase": name, "ms": round((now - self.last) * 1000, 2), "at_ms": round((now - self.t0) * 1000, 2)})
+        self.last = now
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        if not self.done:
+            end = time.perf_counter()
+            self.phases.append({"phase": name, "ms": round((end - start) * 1000, 2), "at_ms": round((end - self.t0) * 1000, 2)})
+            self.last = end
+
+    def report(self):
+        return "\n".join(f"{p['phase']:<24}{p['ms']:>10.2f} ms{p['at_ms']:>12.2f} ms" for p in self.phases)
+
+    def finish(self, log_path):
+        self.done = True
+        append_log_line(log_path, {"ts": datetime.utcnow().isoformat(), "platform": platform, "phases": self.phases},
+                        STARTUP_LOG_BYTES)
+
+def append_log_line(path, record, max_bytes):
+    # one JSON record per line; the file is rotated to <path>.1 past max_bytes
+    try:
+        if os.path.exists(path) and os.path.getsize(path) > max_bytes:
+            os.replace(path, path + ".1")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+    except OSError:
+        pass
+
+PROFILER = StartupProfiler(STARTUP_T0)
+PROFILER.mark("imports", STARTUP_IMPORTS_DONE)
 
 # ---------------- Utilities ----------------
 def ensure_dir(path):
@@ -25,88 +116,1106 @@ def ensure_dir(path):
 def safe_filename(name: str) -> str:
     return "".join(c for c in name if c.isalnum() or c in " _-()").rstrip()
 
+def io_size(data):
+    # encoded size of a payload: bytes, str (UTF-8), a byte count, or an iterable of those
+    if data is None:
+        return 0
+    if isinstance(data, int):
+        return data
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, str):
+        return len(data.encode("utf-8"))
+    return sum(io_size(d) for d in data)
+
+def count_io(read=None, written=None):
+    # bytes actually moved to or from storage, credited to the calls Metrics
+    # is timing on this thread; payloads are only measured while it is on
+    if METRICS.enabled:
+        METRICS.add_bytes(io_size(read), io_size(written))
+
+def atomic_write(path, payload, durable=True):
+    # temp file + fsync + rename: readers see the old file or the new one,
+    # never a truncated mix
+    ensure_dir(os.path.dirname(path))
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(payload)
+            if durable:
+                f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, path)
+        count_io(written=payload)
+    except OSError:
+        # e.g. disk full: do not leave the partial temp file behind
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+
+def write_text_atomic(path, text):
+    atomic_write(path, text.encode("utf-8"), durable=False)
+
+def encode_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class WriteBehind:
+    # Coalesces JSON writes: write_json() queues the encoded payload per path
+    # and a timer flushes everything `delay` seconds after the first pending
+    # write, so a burst of updates to one file costs a single flash write.
+    # read_json() sees queued data first. flush() is called on pause/stop;
+    # a write that fails (disk full) is logged and stays queued for the next.
+    def __init__(self, delay=0.5):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+        self.pending = {}
+        self.writing = {}
+        self.timer = None
+        self.writes = 0
+
+    def put(self, path, payload):
+        with self.lock:
+            self.pending[path] = payload
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def get(self, path):
+        with self.lock:
+            payload = self.pending.get(path)
+            return self.writing.get(path) if payload is None else payload
+
+    def write_now(self, path, payload):
+        # a synchronous write replaces whatever is queued for the path, and
+        # waits out a flush in progress so an older payload cannot land after it
+        with self.io_lock:
+            with self.lock:
+                self.pending.pop(path, None)
+            atomic_write(path, payload)
+
+    def flush(self):
+        with self.io_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel(); self.timer = None
+                batch, self.pending = self.pending, {}
+                self.writing = batch
+            failed = {}
+            for path, payload in batch.items():
+                try:
+                    atomic_write(path, payload)
+                    self.writes += 1
+                except OSError as e:
+                    Logger.warning(f"Smarta: could not write {path}, kept queued: {e}")
+                    failed[path] = payload
+            with self.lock:
+                self.writing = {}
+                for path, payload in failed.items():
+                    self.pending.setdefault(path, payload)  # unless a newer payload was queued meanwhile
+
+WRITES = WriteBehind()
+atexit.register(WRITES.flush)
+
 def read_json(path, default):
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        payload = WRITES.get(path)
+        if payload is not None:
+            return json.loads(payload)
+        with open(path, "rb") as f:
+            data = f.read()
+        count_io(read=data)
+        return json.loads(data)
     except Exception:
         return default
 
-def write_json(path, data):
-    ensure_dir(os.path.dirname(path))
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def write_json(path, data, sync=False):
+    # queued for the write-behind flusher unless sync=True
+    payload = encode_json(data)
+    if sync:
+        WRITES.write_now(path, payload)
+    else:
+        WRITES.put(path, payload)
+
+def flush_writes():
+    WRITES.flush()
+
+class ChangeEvents:
+    # Minimal observer used by the stores: emit(event, **info) calls every
+    # subscriber, e.g. so the app can mark the affected screens dirty.
+    def subscribe(self, callback):
+        self.__dict__.setdefault("listeners", []).append(callback)
+
+    def emit(self, event, **info):
+        for cb in list(self.__dict__.get("listeners", ())):
+            cb(event, **info)
 
 # ---------------- Notes Storage ----------------
-class NotesStore:
-    def __init__(self, base_path):
+SNIPPET_LEN = 120
+NOTE_CHUNK_CHARS = 32 * 1024
+CHUNK_SEQ_STEP = 1024
+
+def chunk_parts(body, size=NOTE_CHUNK_CHARS, first_seq=0):
+    # (seq, text) pieces of about `size` chars, cut after a newline where
+    # possible so editor pages end on whole lines; seqs leave gaps so a
+    # grown piece can be split in place
+    parts = []; start = 0
+    while True:
+        end = min(start + size, len(body))
+        if end < len(body):
+            nl = body.rfind("\n", start + size // 2, end)
+            if nl != -1:
+                end = nl + 1
+        parts.append((first_seq + len(parts) * CHUNK_SEQ_STEP, body[start:end]))
+        start = end
+        if start >= len(body):
+            return parts
+
+class SqliteNotesBackend:
+    # Single-file notes database. Folders and note metadata (title, snippet,
+    # created, size) live in indexed tables so listing a folder is one query;
+    # bodies are stored apart in note_chunks, NOTE_CHUNK_CHARS per row, so a
+    # multi-megabyte note can be read and rewritten a piece at a time.
+    def __init__(self, db_path):
+        ensure_dir(os.path.dirname(db_path))
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS folders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS notes (
+                id TEXT PRIMARY KEY,
+                folder_id INTEGER NOT NULL REFERENCES folders(id),
+                title TEXT NOT NULL DEFAULT '',
+                snippet TEXT NOT NULL DEFAULT '',
+                created TEXT NOT NULL,
+                content_hash TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                chunks INTEGER NOT NULL DEFAULT 1,
+                summary TEXT,
+                summary_hash TEXT);
+            CREATE INDEX IF NOT EXISTS notes_by_folder ON notes(folder_id, id DESC);
+            CREATE TABLE IF NOT EXISTS note_chunks (
+                note_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (note_id, seq));
+            CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        columns = [r["name"] for r in self.db.execute("PRAGMA table_info(notes)")]
+        if "body" in columns:
+            self.migrate_bodies(columns)
+        for col in ("summary", "summary_hash"):
+            if col not in columns:
+                self.db.execute(f"ALTER TABLE notes ADD COLUMN {col} TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS notes_by_hash ON notes(content_hash)")
+        self.db.commit()
+
+    def migrate_bodies(self, columns):
+        # databases from before chunked bodies kept the body inline in notes
+        for col, decl in (("content_hash", "TEXT"), ("size", "INTEGER NOT NULL DEFAULT 0"), ("chunks", "INTEGER NOT NULL DEFAULT 1")):
+            if col not in columns:
+                self.db.execute(f"ALTER TABLE notes ADD COLUMN {col} {decl}")
+        ids = [r["id"] for r in self.db.execute("SELECT id FROM notes WHERE body != ''")]
+        for note_id in ids:
+            body = self.db.execute("SELECT body FROM notes WHERE id=?", (note_id,)).fetchone()["body"]
+            parts = chunk_parts(body)
+            self.db.execute("DELETE FROM note_chunks WHERE note_id=?", (note_id,))
+            self.db.executemany("INSERT INTO note_chunks(note_id, seq, text) VALUES(?, ?, ?)", [(note_id, q, t) for q, t in parts])
+            self.db.execute("UPDATE notes SET body='', size=?, chunks=?, content_hash=? WHERE id=?",
+                            (len(body), len(parts), content_hash(body), note_id))
+        self.db.execute("INSERT INTO note_chunks(note_id, seq, text) SELECT id, 0, '' FROM notes "
+                        "WHERE id NOT IN (SELECT note_id FROM note_chunks)")
+        self.db.execute("UPDATE notes SET content_hash=? WHERE content_hash IS NULL", (content_hash(""),))
+        try:
+            self.db.execute("ALTER TABLE notes DROP COLUMN body")
+        except sqlite3.OperationalError:
+            pass  # SQLite < 3.35: the column stays, always empty
+        self.db.commit()
+
+    def get_flag(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM kv WHERE key=?", (key,)).fetchone()
+            return row["value"] if row else None
+
+    def set_flag(self, key, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO kv(key, value) VALUES(?, ?)", (key, value))
+
+    def list_folders(self):
+        with self.lock:
+            names = [r["name"] for r in self.db.execute("SELECT name FROM folders ORDER BY id")]
+            count_io(read=names)
+            return names
+
+    def folder_id(self, name):
+        row = self.db.execute("SELECT id FROM folders WHERE name=?", (name,)).fetchone()
+        return row["id"] if row else None
+
+    def create_folder(self, name):
+        with self.lock, self.db:
+            if self.folder_id(name) is not None:
+                return False
+            self.db.execute("INSERT INTO folders(name) VALUES(?)", (name,))
+            count_io(written=name)
+            return True
+
+    def rename_folder(self, old, new):
+        # notes reference folders by id, so a rename touches one row
+        with self.lock, self.db:
+            if self.folder_id(old) is None or self.folder_id(new) is not None:
+                return False
+            self.db.execute("UPDATE folders SET name=? WHERE name=?", (new, old))
+            count_io(written=new)
+            return True
+
+    def list_notes(self, folder, before=None, limit=None):
+        with self.lock:
+            fid = self.folder_id(folder)
+            if fid is None:
+                return []
+            sql = "SELECT id, title, snippet, created FROM notes WHERE folder_id=?"
+            args = [fid]
+            if before is not None:
+                sql += " AND id<?"; args.append(before)
+            sql += " ORDER BY id DESC"
+            if limit is not None:
+                sql += " LIMIT ?"; args.append(limit)
+            rows = [dict(r) for r in self.db.execute(sql, args)]
+            count_io(read=(v for r in rows for v in r.values()))
+            return rows
+
+    def write_body(self, note_id, body):
+        parts = chunk_parts(body)
+        self.db.execute("DELETE FROM note_chunks WHERE note_id=?", (note_id,))
+        self.db.executemany("INSERT INTO note_chunks(note_id, seq, text) VALUES(?, ?, ?)", [(note_id, q, t) for q, t in parts])
+        count_io(written=body)
+        return parts
+
+    def insert_notes(self, folder, notes):
+        with self.lock, self.db:
+            fid = self.folder_id(folder)
+            if fid is None:
+                fid = self.db.execute("INSERT INTO folders(name) VALUES(?)", (folder,)).lastrowid
+            for n in notes:
+                parts = self.write_body(n["id"], n["body"])
+                self.db.execute(
+                    "INSERT OR REPLACE INTO notes(id, folder_id, title, snippet, created, content_hash, size, chunks) VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
+                    (n["id"], fid, n["title"], n["body"][:SNIPPET_LEN], n["created"], content_hash(n["body"]), len(n["body"]), len(parts)))
+                count_io(written=(n["title"], n["body"][:SNIPPET_LEN]))
+
+    def update_note(self, folder, note_id, title, body):
+        with self.lock, self.db:
+            cur = self.db.execute(
+                "UPDATE notes SET title=? WHERE id=? AND folder_id=(SELECT id FROM folders WHERE name=?)", (title, note_id, folder))
+            if cur.rowcount == 0:
+                return False
+            parts = self.write_body(note_id, body)
+            self.db.execute("UPDATE notes SET snippet=?, content_hash=?, size=?, chunks=? WHERE id=?",
+                            (body[:SNIPPET_LEN], content_hash(body), len(body), len(parts), note_id))
+            count_io(written=(title, body[:SNIPPET_LEN]))
+            return True
+
+    def chunk_seqs(self, note_id):
+        with self.lock:
+            return [r["seq"] for r in self.db.execute("SELECT seq FROM note_chunks WHERE note_id=? ORDER BY seq", (note_id,))]
+
+    def read_chunk(self, note_id, seq):
+        with self.lock:
+            row = self.db.execute("SELECT text FROM note_chunks WHERE note_id=? AND seq=?", (note_id, seq)).fetchone()
+            text = row["text"] if row else ""
+            count_io(read=text)
+            return text
+
+    def update_chunks(self, folder, note_id, title, changed):
+        # rewrites only the pieces in `changed` ({seq: text}; "" drops the
+        # piece, oversized ones are split), then refreshes size, snippet and
+        # hash by streaming the stored pieces. Returns (old seqs, new seqs,
+        # seqs written, renumbered) - after a renumber every seq may have moved.
+        with self.lock, self.db:
+            cur = self.db.execute(
+                "UPDATE notes SET title=? WHERE id=? AND folder_id=(SELECT id FROM folders WHERE name=?)", (title, note_id, folder))
+            if cur.rowcount == 0:
+                return None
+            old = [r["seq"] for r in self.db.execute("SELECT seq FROM note_chunks WHERE note_id=? ORDER BY seq", (note_id,))]
+            cur = {q: q for q in changed}; written = set(); renumbered = False
+            for orig in sorted(changed):
+                text = changed[orig]; seq = cur[orig]
+                if not text:
+                    self.db.execute("DELETE FROM note_chunks WHERE note_id=? AND seq=?", (note_id, seq))
+                    continue
+                parts = chunk_parts(text) if len(text) > 2 * NOTE_CHUNK_CHARS else [(0, text)]
+                nxt = self.db.execute("SELECT MIN(seq) FROM note_chunks WHERE note_id=? AND seq>?", (note_id, seq)).fetchone()[0]
+                if nxt is not None and seq + len(parts) > nxt:
+                    moved = self.renumber(note_id); renumbered = True
+                    cur = {k: moved.get(v, v) for k, v in cur.items()}; seq = cur[orig]
+                self.db.execute("DELETE FROM note_chunks WHERE note_id=? AND seq=?", (note_id, seq))
+                self.db.executemany("INSERT INTO note_chunks(note_id, seq, text) VALUES(?, ?, ?)",
+                                    [(note_id, seq + i, t) for i, (_, t) in enumerate(parts)])
+                count_io(written=text)
+                written.update(seq + i for i in range(len(parts)))
+            if self.db.execute("SELECT 1 FROM note_chunks WHERE note_id=? LIMIT 1", (note_id,)).fetchone() is None:
+                self.db.execute("INSERT INTO note_chunks(note_id, seq, text) VALUES(?, 0, '')", (note_id,)); written.add(0)
+            h = hashlib.sha256(); size = 0; snippet = ""; new = []
+            for r in self.db.execute("SELECT seq, text FROM note_chunks WHERE note_id=? ORDER BY seq", (note_id,)):
+                data = r["text"].encode("utf-8"); count_io(read=len(data))
+                h.update(data); size += len(r["text"]); new.append(r["seq"])
+                if len(snippet) < SNIPPET_LEN:
+                    snippet += r["text"][:SNIPPET_LEN - len(snippet)]
+            self.db.execute("UPDATE notes SET snippet=?, content_hash=?, size=?, chunks=? WHERE id=?",
+                            (snippet, h.hexdigest(), size, len(new), note_id))
+            count_io(written=(title, snippet))
+            return old, new, written, renumbered
+
+    def renumber(self, note_id):
+        # re-spaces a note's pieces CHUNK_SEQ_STEP apart; returns {old seq: new seq}
+        seqs = [r["seq"] for r in self.db.execute("SELECT seq FROM note_chunks WHERE note_id=? ORDER BY seq", (note_id,))]
+        self.db.execute("UPDATE note_chunks SET seq=-seq-1 WHERE note_id=?", (note_id,))
+        self.db.executemany("UPDATE note_chunks SET seq=? WHERE note_id=? AND seq=?",
+                            [(i * CHUNK_SEQ_STEP, note_id, -q - 1) for i, q in enumerate(seqs)])
+        return {q: i * CHUNK_SEQ_STEP for i, q in enumerate(seqs)}
+
+    def known_hashes(self, hashes):
+        with self.lock:
+            found = set()
+            hashes = list(hashes)
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                found.update(r["content_hash"] for r in self.db.execute(
+                    f"SELECT DISTINCT content_hash FROM notes WHERE content_hash IN ({','.join('?' * len(chunk))})", chunk))
+            return found
+
+    def summary_targets(self, folder=None, note_ids=None):
+        # notes of a folder and/or the given ids, with their current and summarized content hashes
+        sql = "SELECT n.id, n.title, n.size, n.content_hash, n.summary_hash, f.name AS folder FROM notes n JOIN folders f ON f.id=n.folder_id"
+        with self.lock:
+            if note_ids is None:
+                return [dict(r) for r in self.db.execute(sql + " WHERE f.name=? ORDER BY n.id DESC", (folder,))]
+            ids = list(note_ids); rows = []
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                rows.extend(dict(r) for r in self.db.execute(f"{sql} WHERE n.id IN ({','.join('?' * len(chunk))})", chunk))
+        return [r for r in rows if folder is None or r["folder"] == folder]
+
+    def set_summary(self, note_id, summary, summary_hash):
+        with self.lock, self.db:
+            self.db.execute("UPDATE notes SET summary=?, summary_hash=? WHERE id=?", (summary, summary_hash, note_id))
+
+    def note_folder(self, note_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT f.name FROM notes n JOIN folders f ON f.id=n.folder_id WHERE n.id=?", (note_id,)).fetchone()
+            return row["name"] if row else None
+
+    def iter_notes(self, bodies=True, batch=200):
+        # with bodies, each note also carries `parts`, its (seq, text) pieces
+        with self.lock:
+            rows = [dict(r) for r in self.db.execute("SELECT id, title, created FROM notes ORDER BY id")]
+        for i in range(0, len(rows), batch):
+            chunk = rows[i:i + batch]
+            if bodies:
+                parts = {}
+                with self.lock:
+                    for r in self.db.execute(
+                            f"SELECT note_id, seq, text FROM note_chunks WHERE note_id IN ({','.join('?' * len(chunk))}) ORDER BY note_id, seq",
+                            [n["id"] for n in chunk]):
+                        parts.setdefault(r["note_id"], []).append((r["seq"], r["text"]))
+                count_io(read=(t for p in parts.values() for _, t in p))
+                for n in chunk:
+                    n["parts"] = parts.get(n["id"], [])
+                    n["body"] = "".join(t for _, t in n["parts"])
+            yield from chunk
+
+    def note_info(self, folder, note_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT n.id, n.title, n.created, n.size, n.chunks, n.summary FROM notes n JOIN folders f ON f.id=n.folder_id "
+                "WHERE n.id=? AND f.name=?", (note_id, folder)).fetchone()
+            data = dict(row) if row else {}
+            count_io(read=(v for v in data.values() if isinstance(v, str)))
+            return data
+
+    def load_note(self, folder, note_id):
+        with self.lock:
+            data = self.note_info(folder, note_id)
+            if data:
+                data["body"] = "".join(r["text"] for r in self.db.execute(
+                    "SELECT text FROM note_chunks WHERE note_id=? ORDER BY seq", (note_id,)))
+                count_io(read=data["body"])
+            return data
+
+def content_hash(body):
+    return hashlib.sha256((body or "").encode("utf-8")).hexdigest()
+
+_id_lock = threading.Lock()
+_last_id = [""]
+
+def new_id():
+    # timestamp ids, bumped when two are minted within the same microsecond
+    with _id_lock:
+        nid = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+        if nid <= _last_id[0]:
+            nid = str(int(_last_id[0]) + 1)
+        _last_id[0] = nid
+        return nid
+
+class NotesStore(ChangeEvents):
+    def __init__(self, base_path, backend=None, search_index=None, autocomplete=None):
         self.base = os.path.join(base_path, "notes")
         ensure_dir(self.base)
-        self.meta_path = os.path.join(self.base, "metadata.json")
-        self.meta = read_json(self.meta_path, {"folders": ["Default"]})
-        for f in self.meta["folders"]:
-            ensure_dir(os.path.join(self.base, "folders", safe_filename(f)))
+        self.backend = backend or SqliteNotesBackend(os.path.join(self.base, "notes.db"))
+        self.search_index = search_index
+        self.autocomplete = autocomplete
+        if not self.backend.get_flag("legacy_migrated"):
+            self.migrate_legacy()
+        if not self.backend.list_folders():
+            self.backend.create_folder("Default")
 
-    def save_meta(self):
-        write_json(self.meta_path, self.meta)
+    def migrate_legacy(self):
+        # one-time import of the old notes/folders/<folder>/<id>.json layout;
+        # the old files are left in place untouched
+        meta = read_json(os.path.join(self.base, "metadata.json"), {"folders": []})
+        for folder in meta.get("folders", []):
+            self.backend.create_folder(folder)
+            folder_path = os.path.join(self.base, "folders", safe_filename(folder))
+            if not os.path.isdir(folder_path):
+                continue
+            notes = []
+            for fname in os.listdir(folder_path):
+                if not fname.endswith(".json"):
+                    continue
+                data = read_json(os.path.join(folder_path, fname), None)
+                if not isinstance(data, dict):
+                    continue
+                notes.append({"id": str(data.get("id") or fname[:-5]), "title": data.get("title") or "",
+                              "body": data.get("body") or "", "created": data.get("created") or ""})
+            if notes:
+                self.backend.insert_notes(folder, notes)
+        self.backend.set_flag("legacy_migrated", "1")
 
     def list_folders(self):
-        return list(self.meta.get("folders", []))
+        return self.backend.list_folders()
 
     def create_folder(self, name):
         name = name.strip() or "Unnamed"
-        if name in self.meta["folders"]:
-            return False
-        self.meta["folders"].append(name)
-        ensure_dir(os.path.join(self.base, "folders", safe_filename(name)))
-        self.save_meta()
-        return True
+        ok = self.backend.create_folder(name)
+        if ok:
+            self.emit("folder_created", folder=name)
+        return ok
 
     def rename_folder(self, old, new):
         new = new.strip() or "Unnamed"
-        if old not in self.meta["folders"] or new in self.meta["folders"]:
-            return False
-        idx = self.meta["folders"].index(old)
-        self.meta["folders"][idx] = new
-        old_path = os.path.join(self.base, "folders", safe_filename(old))
-        new_path = os.path.join(self.base, "folders", safe_filename(new))
-        if os.path.exists(old_path):
-            shutil.move(old_path, new_path)
-        else:
-            ensure_dir(new_path)
-        self.save_meta()
-        return True
+        ok = self.backend.rename_folder(old, new)
+        if ok:
+            self.emit("folder_renamed", old=old, new=new)
+        return ok
 
-    def list_notes(self, folder):
-        folder_path = os.path.join(self.base, "folders", safe_filename(folder))
-        ensure_dir(folder_path)
-        notes = []
-        for fname in os.listdir(folder_path):
-            if fname.endswith(".json"):
-                notes.append(fname)
-        notes.sort(reverse=True)
-        return notes
+    def list_notes(self, folder, before=None, limit=None):
+        # newest first; each row carries id, title, snippet and created.
+        # Pass the last id seen as `before` to fetch the next page.
+        return self.backend.list_notes(folder, before, limit)
 
     def save_note(self, folder, title, body):
-        folder_path = os.path.join(self.base, "folders", safe_filename(folder))
-        ensure_dir(folder_path)
-        note_id = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-        path = os.path.join(folder_path, f"{note_id}.json")
+        note_id = new_id()
         data = {"id": note_id, "title": title, "body": body, "created": datetime.utcnow().isoformat()}
-        write_json(path, data)
-        return path
+        self.backend.insert_notes(folder, [data])
+        self.index_note(note_id, title, chunk_parts(body))
+        self.suggest_notes([data])
+        self.emit("note_saved", folder=folder, note_id=note_id)
+        return note_id
+
+    def save_notes(self, folder, items):
+        # batch insert of (title, body) pairs: one transaction, one index batch, one event
+        now = datetime.utcnow().isoformat()
+        notes = [{"id": new_id(), "title": title, "body": body, "created": now} for title, body in items]
+        if not notes:
+            return []
+        self.backend.insert_notes(folder, notes)
+        if self.search_index is not None:
+            self.search_index.index_docs([e for n in notes for e in self.index_entries(n["id"], n["title"], chunk_parts(n["body"]))])
+        self.suggest_notes(notes)
+        self.emit("note_saved", folder=folder, note_id=notes[-1]["id"])
+        return [n["id"] for n in notes]
+
+    def known_hashes(self, hashes):
+        return self.backend.known_hashes(hashes)
+
+    def update_note(self, folder, note_id, title, body):
+        old = self.backend.chunk_seqs(note_id)
+        ok = self.backend.update_note(folder, note_id, title, body)
+        if ok:
+            self.unindex_note(note_id, old)
+            self.index_note(note_id, title, chunk_parts(body))
+            self.suggest_notes([{"id": note_id, "title": title, "created": None}])
+            self.emit("note_saved", folder=folder, note_id=note_id)
+        return ok
+
+    def update_chunks(self, folder, note_id, title, changed):
+        # editor save: only the edited pieces are rewritten and re-indexed
+        old_title = self.backend.note_info(folder, note_id).get("title")
+        res = self.backend.update_chunks(folder, note_id, title, changed)
+        if res is None:
+            return False
+        old, new, written, renumbered = res
+        if self.search_index is not None:
+            if len(old) > 1 and len(new) > 1 and not renumbered:
+                for seq in set(old) - set(new):
+                    self.search_index.remove_doc(f"note:{note_id}#{seq}")
+                seqs = [q for q in new if q in written] if title == old_title else new
+            else:
+                # pieces were renumbered or the note crossed the one-piece line: doc ids changed
+                self.unindex_note(note_id, old); seqs = new
+            self.search_index.index_docs([(f"note:{note_id}#{q}" if len(new) > 1 else f"note:{note_id}", "note", note_id, title,
+                                           self.backend.read_chunk(note_id, q)) for q in seqs])
+        self.suggest_notes([{"id": note_id, "title": title, "created": None}])
+        self.emit("note_saved", folder=folder, note_id=note_id)
+        return True
+
+    def index_entry(self, note_id, title, body):
+        return (f"note:{note_id}", "note", note_id, title, body)
+
+    def index_entries(self, note_id, title, parts):
+        # one search doc per note; large notes get one per piece so an edit
+        # re-indexes just the pieces it touched
+        if len(parts) == 1:
+            return [self.index_entry(note_id, title, parts[0][1])]
+        return [(f"note:{note_id}#{seq}", "note", note_id, title, text) for seq, text in parts]
+
+    def index_note(self, note_id, title, parts):
+        if self.search_index is not None:
+            self.search_index.index_docs(self.index_entries(note_id, title, parts))
+
+    def unindex_note(self, note_id, seqs):
+        if self.search_index is not None:
+            for doc in [f"note:{note_id}"] + [f"note:{note_id}#{q}" for q in seqs if len(seqs) > 1]:
+                self.search_index.remove_doc(doc)
+
+    def suggest_notes(self, notes):
+        if self.autocomplete is not None:
+            self.autocomplete.add_notes([(n["id"], n["title"], n["created"]) for n in notes])
+
+    def note_folder(self, note_id):
+        return self.backend.note_folder(note_id)
+
+    def summary_targets(self, folder=None, note_ids=None):
+        return self.backend.summary_targets(folder, note_ids)
+
+    def set_summary(self, folder, note_id, summary, summary_hash):
+        # summary_hash: content hash of the body the summary was made from
+        self.backend.set_summary(note_id, summary, summary_hash)
+        self.emit("note_summarized", folder=folder, note_id=note_id)
+
+    def iter_notes(self, bodies=True):
+        return self.backend.iter_notes(bodies)
+
+    def note_info(self, folder, note_id):
+        # metadata only (title, created, size, chunks): cheap for any note size
+        return self.backend.note_info(folder, note_id)
+
+    def chunk_seqs(self, note_id):
+        return self.backend.chunk_seqs(note_id)
+
+    def read_chunk(self, note_id, seq):
+        return self.backend.read_chunk(note_id, seq)
+
+    def load_note(self, folder, note_id):
+        if note_id.endswith(".json"):
+            note_id = note_id[:-5]
+        return self.backend.load_note(folder, note_id)
+
+# ---------------- Append Logs ----------------
+SEGMENT_BYTES = 256 * 1024
+
+def record_key(rec):
+    # the order every device converges on: Lamport clock, then author device;
+    # records from before sync (no clock) come first, in log order
+    return (rec.get("lc", 0), rec.get("dev", ""), rec.get("dseq", 0))
+
+class SegmentLog:
+    # Append-only record log used for community chat and posts: JSON Lines
+    # segments rotated at segment_bytes, plus a small index of sealed segments
+    # (name, first_seq, count, and for sync their version vector and clock).
+    # Appending writes one line; reading a page touches only the newest
+    # segment(s). A torn trailing line from a crash is dropped on open.
+    # With a device id, appends are stamped for sync (dev, dseq, lc) and
+    # merge() folds in other devices' records in record_key order.
+    def __init__(self, path, segment_bytes=SEGMENT_BYTES, device=None):
+        self.path = path
+        ensure_dir(path)
+        self.segment_bytes = segment_bytes
+        self.device = device
+        self.lock = threading.RLock()
+        self.index_path = os.path.join(path, "segments.json")
+        self.journal_path = os.path.join(path, "merge.json")
+        self.sealed = read_json(self.index_path, {"segments": []})["segments"]
+        journal = read_json(self.journal_path, None)
+        if journal is not None:
+            self.rewrite(journal["segment"], journal["records"], journal.get("end"))  # finish a rewrite cut short
+        else:
+            self.open_active()
+
+    def segment_file(self, name):
+        return os.path.join(self.path, name)
+
+    def open_active(self):
+        self.active_name = f"{len(self.sealed) + 1:06d}.jsonl"
+        self.active_first = self.sealed[-1]["first_seq"] + self.sealed[-1]["count"] if self.sealed else 1
+        path = self.segment_file(self.active_name)
+        self.active_count = 0; self.active_size = 0
+        self.active_meta = {"vv": {}, "lc": 0}; self.active_legacy = False
+        self.vv = {}; self.clock = 0
+        for seg in self.sealed:
+            for dev, n in seg.get("vv", {}).items():
+                self.vv[dev] = max(self.vv.get(dev, 0), n)
+            self.clock = max(self.clock, seg.get("lc", 0))
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+        self.active_count = data.count(b"\n", 0, end)
+        self.active_size = end
+        for line in data[:end].splitlines():
+            try:
+                self.note(json.loads(line))
+            except ValueError:
+                pass
+
+    def note(self, rec):
+        # fold a record into the version vector / clock of the log and the active segment
+        dev = rec.get("dev")
+        if dev is None:
+            self.active_legacy = True
+            return
+        for vv in (self.vv, self.active_meta["vv"]):
+            if rec["dseq"] > vv.get(dev, 0):
+                vv[dev] = rec["dseq"]
+        lc = rec.get("lc", 0)
+        self.clock = max(self.clock, lc); self.active_meta["lc"] = max(self.active_meta["lc"], lc)
+
+    @property
+    def next_seq(self):
+        return self.active_first + self.active_count
+
+    def append(self, msg):
+        with self.lock:
+            if self.device is not None and "dev" not in msg:
+                msg = dict(msg, dev=self.device, dseq=self.vv.get(self.device, 0) + 1, lc=self.clock + 1)
+            msg = dict(msg, seq=self.next_seq)
+            line = (json.dumps(msg, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+            if self.active_count and self.active_size + len(line) > self.segment_bytes:
+                self.rotate()
+                msg["seq"] = self.next_seq
+                line = (json.dumps(msg, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+            with open(self.segment_file(self.active_name), "ab") as f:
+                f.write(line)
+            count_io(written=line)
+            self.active_count += 1; self.active_size += len(line)
+            self.note(msg)
+            return msg
+
+    def append_many(self, msgs):
+        return [self.append(m) for m in msgs]
+
+    def rotate(self):
+        self.sealed.append({"name": self.active_name, "first_seq": self.active_first, "count": self.active_count,
+                            "vv": dict(self.active_meta["vv"]), "lc": self.active_meta["lc"]})
+        if self.active_legacy:
+            del self.sealed[-1]["vv"]  # marks the segment for adopt()
+        write_json(self.index_path, {"segments": self.sealed}, sync=True)
+        self.open_active()
+
+    def segments(self):
+        with self.lock:
+            return self.sealed + [{"name": self.active_name, "first_seq": self.active_first, "count": self.active_count,
+                                   "vv": dict(self.active_meta["vv"]), "lc": self.active_meta["lc"]}]
+
+    def write_segment(self, name, records, first_seq):
+        # replaces a segment file in one atomic write; returns its sync metadata
+        meta = {"vv": {}, "lc": 0}; lines = []
+        for i, rec in enumerate(records):
+            rec = dict(rec, seq=first_seq + i)
+            lines.append(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+            if "dev" in rec:
+                meta["vv"][rec["dev"]] = max(meta["vv"].get(rec["dev"], 0), rec["dseq"])
+            else:
+                meta["legacy"] = True
+            meta["lc"] = max(meta["lc"], rec.get("lc", 0))
+        atomic_write(self.segment_file(name), "".join(l + "\n" for l in lines).encode("utf-8"))
+        if meta.pop("legacy", False):
+            del meta["vv"]
+        return meta
+
+    def rewrite(self, k, records, end=None):
+        # sealed segments k..end-1 get `records` in order, keeping their counts
+        # (so their seq ranges stay put); with no `end` the rest of the
+        # records becomes the active segment
+        with self.lock:
+            pos = 0
+            for seg in self.sealed[k:end]:
+                part = records[pos:pos + seg["count"]]; pos += len(part)
+                seg.pop("vv", None); seg.update(self.write_segment(seg["name"], part, seg["first_seq"]))
+            write_json(self.index_path, {"segments": self.sealed}, sync=True)
+            if end is None:
+                first = self.sealed[-1]["first_seq"] + self.sealed[-1]["count"] if self.sealed else 1
+                self.write_segment(f"{len(self.sealed) + 1:06d}.jsonl", records[pos:], first)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.open_active()
+
+    def journaled_rewrite(self, k, records, end=None):
+        # the journal holds just the segments being rewritten, so a crash
+        # halfway through is finished on the next open instead of losing records
+        write_json(self.journal_path, {"segment": k, "end": end, "records": records}, sync=True)
+        self.rewrite(k, records, end)
 
-    def load_note(self, folder, note_file):
-        path = os.path.join(self.base, "folders", safe_filename(folder), note_file)
-        return read_json(path, {})
+    def merge(self, records):
+        # other devices' records: ones already held are dropped by version
+        # vector, the rest land in record_key order - usually an append; a
+        # record that sorts before local ones rewrites from its segment on
+        with self.lock:
+            seen = dict(self.vv); fresh = []
+            for r in sorted(records, key=lambda r: (r["dev"], r["dseq"])):
+                if r["dev"] != self.device and r["dseq"] > seen.get(r["dev"], 0):
+                    seen[r["dev"]] = r["dseq"]
+                    fresh.append({k: v for k, v in r.items() if k not in ("seq", "rseq")})
+            if not fresh:
+                return []
+            fresh.sort(key=record_key)
+            segs = self.segments()
+            k = len(segs) - 1; region = self.read_segment(segs[k]["name"])
+            while k > 0 and not region:
+                k -= 1; region = self.read_segment(segs[k]["name"])
+            if not region or record_key(region[-1]) < record_key(fresh[0]):
+                return [self.append(r) for r in fresh]
+            while k > 0 and record_key(region[0]) > record_key(fresh[0]):
+                k -= 1; region = self.read_segment(segs[k]["name"]) + region
+            self.journaled_rewrite(min(k, len(self.sealed)), sorted(region + fresh, key=record_key))
+            return fresh
+
+    def adopt(self):
+        # stamps records written before sync existed as this device's so they
+        # can be pushed. They precede every stamped record and lc 0 keeps them
+        # there, so each legacy segment is rewritten in place: same order,
+        # same seqs, one segment per journal.
+        with self.lock:
+            if self.device is None:
+                return False
+            dseq = self.vv.get(self.device, 0); adopted = False
+            for k, seg in enumerate(self.segments()):
+                tail = k == len(self.sealed)
+                if not (self.active_legacy if tail else "vv" not in seg):
+                    continue
+                records = self.read_segment(seg["name"])
+                for i, rec in enumerate(records):
+                    if "dev" not in rec:
+                        dseq += 1
+                        records[i] = dict(rec, dev=self.device, dseq=dseq, lc=0)
+                self.journaled_rewrite(k, records, None if tail else k + 1)
+                adopted = True
+            return adopted
+
+    def own_since(self, dseq, limit):
+        # this device's records after `dseq`, in dseq order (for pushing)
+        out = []
+        for seg in self.segments():
+            if seg.get("vv", {}).get(self.device, 0) > dseq:
+                out.extend(r for r in self.read_segment(seg["name"]) if r.get("dev") == self.device and r["dseq"] > dseq)
+        out.sort(key=lambda r: r["dseq"])
+        return out[:limit]
+
+    def read_segment(self, name):
+        out = []; size = 0
+        try:
+            with open(self.segment_file(name), "rb") as f:
+                for line in f:
+                    size += len(line)
+                    try:
+                        out.append(json.loads(line))
+                    except ValueError:
+                        pass
+        except OSError:
+            pass
+        count_io(read=size)
+        return out
+
+    def __iter__(self):
+        with self.lock:
+            names = [seg["name"] for seg in self.sealed] + [self.active_name]
+        for name in names:
+            yield from self.read_segment(name)
+
+    def page(self, before=None, limit=50):
+        # the newest `limit` records with seq < before, oldest first
+        segs = self.segments()
+        out = []
+        for seg in reversed(segs):
+            if before is not None and seg["first_seq"] >= before:
+                continue
+            msgs = self.read_segment(seg["name"])
+            if before is not None:
+                msgs = [m for m in msgs if m.get("seq", 0) < before]
+            need = limit - len(out)
+            out = msgs[-need:] + out
+            if len(out) >= limit:
+                break
+        return out
+
+# ---------------- Attachment Blobs ----------------
+BLOB_CHUNK = 1024 * 1024
+
+class BlobStore:
+    # Content-addressed attachment storage shared by all communities:
+    # blobs/<aa>/<sha256>. Files are hashed while they are copied, so the same
+    # file posted to several communities is stored once. Files the app already
+    # owns (under its data dir) are hardlinked instead of copied when the
+    # filesystem allows it. Large copies run on a background worker.
+    def __init__(self, path, owned_root=None, workers=1):
+        self.path = path
+        self.tmp = os.path.join(path, "tmp")
+        ensure_dir(self.tmp)
+        self.owned_root = os.path.realpath(owned_root or os.path.dirname(path))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blobs")
+        self.lock = threading.Lock()
+        self.known = {}  # (realpath, size, mtime) -> digest, skips re-hashing a re-posted file
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.blob_path(digest))
+
+    def commit_tmp(self, tmp, digest):
+        dest = self.blob_path(digest)
+        if os.path.exists(dest):
+            os.remove(tmp)
+        else:
+            ensure_dir(os.path.dirname(dest))
+            os.replace(tmp, dest)
+        return digest
+
+    def hash_file(self, src, progress=None):
+        h = hashlib.sha256()
+        total = os.path.getsize(src); done = 0
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(BLOB_CHUNK), b""):
+                h.update(chunk); done += len(chunk)
+                if progress: progress(done, total)
+        return h.hexdigest()
+
+    def put_file(self, src, progress=None):
+        real = os.path.realpath(src)
+        st = os.stat(real)
+        sig = (real, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            digest = self.known.get(sig)
+        if digest and self.has(digest):
+            if progress: progress(st.st_size, st.st_size)
+            return digest
+        if real.startswith(self.owned_root + os.sep):
+            digest = self.link_file(real, progress)
+        else:
+            digest = self.copy_file(real, st.st_size, progress)
+        with self.lock:
+            self.known[sig] = digest
+        return digest
+
+    def link_file(self, src, progress=None):
+        digest = self.hash_file(src, progress)
+        if self.has(digest):
+            return digest
+        tmp = os.path.join(self.tmp, f"{digest}.{new_id()}")
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        return self.commit_tmp(tmp, digest)
+
+    def copy_file(self, src, total, progress=None):
+        h = hashlib.sha256(); done = 0
+        fd, tmp = tempfile.mkstemp(dir=self.tmp)
+        try:
+            with open(src, "rb") as fin, os.fdopen(fd, "wb") as fout:
+                for chunk in iter(lambda: fin.read(BLOB_CHUNK), b""):
+                    h.update(chunk); fout.write(chunk); done += len(chunk)
+                    if progress: progress(done, total)
+            return self.commit_tmp(tmp, h.hexdigest())
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def put_async(self, src, on_done, on_progress=None, on_error=None):
+        # on_* callbacks run on the UI thread; progress is reported per 5%
+        last = [-1]
+        def progress(done, total):
+            pct = int(done * 100 / total) if total else 100
+            if on_progress and pct // 5 != last[0]:
+                last[0] = pct // 5
+                Clock.schedule_once(lambda dt: on_progress(pct), 0)
+        def work():
+            try:
+                digest = self.put_file(src, progress)
+                Clock.schedule_once(lambda dt: on_done(digest), 0)
+            except Exception as e:
+                if on_error: Clock.schedule_once(lambda dt, e=e: on_error(e), 0)
+        return self.executor.submit(work)
+
+    def gc(self, referenced, min_age=3600):
+        # delete blobs no post references; recent files are kept so an upload
+        # whose post has not been written yet is not collected
+        cutoff = time.time() - min_age
+        removed = 0
+        for root, dirs, files in os.walk(self.path):
+            for fname in files:
+                p = os.path.join(root, fname)
+                in_tmp = root == self.tmp
+                if (in_tmp or fname not in referenced) and os.path.getmtime(p) < cutoff:
+                    os.remove(p); removed += 1
+        return removed
+
+# ---------------- Attachment Previews ----------------
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'}
+TEXT_EXTS = {'.txt', '.md', '.csv', '.json', '.py', '.log', '.html', '.xml'}
+THUMB_SIZE = (160, 160)
+PREVIEW_LINES = 3
+
+class PreviewCache:
+    # Thumbnails and text previews for post attachments, generated lazily on a
+    # worker pool and kept in a size-capped directory keyed by file path plus
+    # mtime. Full-size images are only ever decoded off the UI thread.
+    # Image thumbnails need Pillow; without it only text previews are made.
+    # Keys that failed to build (no Pillow, unreadable file) are remembered
+    # for the session, so rebinding a row does not retry them.
+    def __init__(self, path, max_bytes=20 * 1024 * 1024, workers=2):
+        self.path = path
+        ensure_dir(path)
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='previews')
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.failed = set()  # file names whose build raised
+        self.entries = {}  # file name -> (size, last access)
+        for fname in os.listdir(path):
+            st = os.stat(os.path.join(path, fname))
+            self.entries[fname] = (st.st_size, st.st_mtime)
+        self.total = sum(size for size, _ in self.entries.values())
+
+    @staticmethod
+    def kind_of(name):
+        ext = os.path.splitext(name or '')[1].lower()
+        return 'image' if ext in IMAGE_EXTS else 'text' if ext in TEXT_EXTS else None
+
+    def key_for(self, src):
+        try:
+            st = os.stat(src)
+        except OSError:
+            return None
+        return hashlib.sha1(f"{src}|{st.st_mtime_ns}|{st.st_size}".encode('utf-8')).hexdigest()
+
+    def load(self, fname):
+        p = os.path.join(self.path, fname)
+        if fname.endswith('.txt'):
+            with open(p, 'r', encoding='utf-8') as f:
+                return {'kind': 'text', 'text': f.read()}
+        return {'kind': 'image', 'path': p}
+
+    def get(self, src, name, on_ready):
+        # returns a cached preview right away, otherwise None and on_ready(preview)
+        # is called on the UI thread once the worker has made it
+        kind = self.kind_of(name)
+        key = self.key_for(src) if kind else None
+        if key is None:
+            return None
+        fname = key + ('.txt' if kind == 'text' else '.png')
+        with self.lock:
+            if fname in self.entries:
+                self.entries[fname] = (self.entries[fname][0], time.time())
+                hit = True
+            else:
+                hit = False
+                if fname in self.failed:
+                    return None
+                waiters = self.inflight.get(fname)
+                if waiters is not None:
+                    waiters.append(on_ready); return None
+                self.inflight[fname] = [on_ready]
+        if hit:
+            try:
+                return self.load(fname)
+            except OSError:
+                with self.lock:
+                    size, _ = self.entries.pop(fname, (0, 0))
+                    self.total -= size
+                return None
+        self.executor.submit(self.build, src, kind, fname)
+        return None
+
+    def build(self, src, kind, fname):
+        dest = os.path.join(self.path, fname)
+        try:
+            if kind == 'text':
+                with open(src, 'r', encoding='utf-8', errors='replace') as f:
+                    lines = [f.readline(200).rstrip('\n') for _ in range(PREVIEW_LINES)]
+                write_text_atomic(dest, '\n'.join(l for l in lines if l))
+            else:
+                from PIL import Image as PILImage
+                with PILImage.open(src) as im:
+                    im.draft('RGB', THUMB_SIZE)
+                    im.thumbnail(THUMB_SIZE)
+                    tmp = dest + '.tmp'
+                    im.convert('RGBA' if im.mode in ('RGBA', 'LA', 'P') else 'RGB').save(tmp, 'PNG')
+                    os.replace(tmp, dest)
+            preview = self.load(fname)
+            self.added(fname, os.path.getsize(dest))
+        except Exception as e:
+            Logger.warning(f"Smarta: no preview for {src}: {e}")
+            preview = None
+        with self.lock:
+            if preview is None:
+                self.failed.add(fname)
+            waiters = self.inflight.pop(fname, [])
+        if preview is not None:
+            Clock.schedule_once(lambda dt: [cb(preview) for cb in waiters], 0)
+
+    def added(self, fname, size):
+        with self.lock:
+            self.entries[fname] = (size, time.time())
+            self.total += size
+            if self.total <= self.max_bytes:
+                return
+            victims = sorted(self.entries.items(), key=lambda kv: kv[1][1])
+            for victim, (vsize, _) in victims:
+                if self.total <= self.max_bytes or victim == fname:
+                    break
+                try: os.remove(os.path.join(self.path, victim))
+                except OSError: pass
+                del self.entries[victim]
+                self.total -= vsize
 
 # ---------------- Communities Storage ----------------
-class CommunityStore:
-    def __init__(self, base_path):
+class CommunityStore(ChangeEvents):
+    def __init__(self, base_path, search_index=None, blobs=None):
         self.base = os.path.join(base_path, "communities")
         ensure_dir(self.base)
+        self.blobs = blobs or BlobStore(os.path.join(base_path, "blobs"), owned_root=base_path)
+        self.search_index = search_index
         self.index_path = os.path.join(self.base, "index.json")
         self.index = read_json(self.index_path, {"communities": []})
+        if "device" not in self.index:
+            # this install's id in synced records
+            self.index["device"] = os.urandom(8).hex()
+            write_json(self.index_path, self.index, sync=True)
+        self.device = self.index["device"]
+        self.lock = threading.Lock()  # logs and the index are touched from the UI, I/O and sync threads
+        self.logs = {}
+        self.post_logs = {}
 
     def save_index(self):
         write_json(self.index_path, self.index)
@@ -116,59 +1225,2015 @@ class CommunityStore:
 
     def create_community(self, name):
         name = name.strip() or "Unnamed"
-        if name in self.index["communities"]:
-            return False
-        self.index["communities"].append(name)
-        ensure_dir(self.community_path(name))
-        write_json(self.posts_path(name), {"posts": []})
-        write_json(self.messages_path(name), {"messages": []})
-        self.save_index()
+        with self.lock:  # the sync thread creates communities too
+            if name in self.index["communities"]:
+                return False
+            self.index["communities"].append(name)
+            ensure_dir(self.community_path(name))
+            self.save_index()
+        self.emit("community_created", community=name)
         return True
 
     def community_path(self, name):
         return os.path.join(self.base, safe_filename(name))
 
     def posts_path(self, name):
+        # legacy single-file timeline (newest first), imported on first use
         return os.path.join(self.community_path(name), "posts.json")
 
+    def post_log(self, name):
+        with self.lock:
+            log = self.post_logs.get(name)
+            if log is None:
+                log_dir = os.path.join(self.community_path(name), "posts")
+                fresh = not os.path.exists(os.path.join(log_dir, "000001.jsonl"))
+                log = SegmentLog(log_dir, device=self.device)
+                if fresh and os.path.exists(self.posts_path(name)):
+                    log.append_many(reversed(read_json(self.posts_path(name), {"posts": []})["posts"]))
+                self.post_logs[name] = log
+            return log
+
     def messages_path(self, name):
+        # legacy single-file history, imported into the message log on first use
         return os.path.join(self.community_path(name), "messages.json")
 
+    def message_log(self, name):
+        with self.lock:
+            log = self.logs.get(name)
+            if log is None:
+                log_dir = os.path.join(self.community_path(name), "messages")
+                fresh = not os.path.exists(os.path.join(log_dir, "000001.jsonl"))
+                log = SegmentLog(log_dir, device=self.device)
+                if fresh and os.path.exists(self.messages_path(name)):
+                    log.append_many(read_json(self.messages_path(name), {"messages": []})["messages"])
+                self.logs[name] = log
+            return log
+
     def attachments_path(self, name):
         p = os.path.join(self.community_path(name), "attachments")
         ensure_dir(p)
         return p
 
-    def add_post(self, community, author, text, attachment_src=None):
-        posts = read_json(self.posts_path(community), {"posts": []})
-        post_id = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-        attachment_local = None
-        if attachment_src:
-            att_folder = self.attachments_path(community)
+    def add_post(self, community, author, text, attachment_src=None, blob=None):
+        # blob: digest of an attachment already in the blob store (see
+        # BlobStore.put_async); otherwise attachment_src is stored inline
+        post_id = new_id()
+        name = os.path.basename(attachment_src) if attachment_src else None
+        if attachment_src and blob is None:
             try:
-                base = os.path.basename(attachment_src)
-                dest = os.path.join(att_folder, f"{post_id}_{base}")
-                shutil.copy2(attachment_src, dest)
-                attachment_local = dest
+                blob = self.blobs.put_file(attachment_src)
             except Exception:
-                attachment_local = None
-        post = {"id": post_id, "author": author, "text": text, "attachment": attachment_local, "created": datetime.utcnow().isoformat()}
-        posts["posts"].insert(0, post)
-        write_json(self.posts_path(community), posts)
+                blob = None
+        post = {"id": post_id, "author": author, "text": text, "created": datetime.utcnow().isoformat(),
+                "attachment": self.blobs.blob_path(blob) if blob else None,
+                "attachment_blob": blob, "attachment_name": name if blob else None}
+        post = self.post_log(community).append(post)
+        self.index_post(community, post)
+        self.emit("post_added", community=community, post=post)
         return post
 
-    def list_posts(self, community):
-        return read_json(self.posts_path(community), {"posts": []})["posts"]
+    def index_entry(self, community, post):
+        return (f"post:{community}:{post['id']}", "post", community,
+                f"{post['author']} in {community}", post.get("text") or "")
+
+    def index_post(self, community, post):
+        if self.search_index is not None:
+            self.search_index.index_doc(*self.index_entry(community, post))
+
+    def list_posts(self, community, cursor=None, limit=20):
+        # newest first; pass the last post's seq as `cursor` for the next page
+        return self.post_log(community).page(cursor, limit)[::-1]
+
+    def iter_posts(self, community):
+        return iter(self.post_log(community))
+
+    def collect_garbage(self, min_age=3600):
+        referenced = set()
+        for c in self.list_communities():
+            referenced.update(p["attachment_blob"] for p in self.iter_posts(c) if p.get("attachment_blob"))
+        return self.blobs.gc(referenced, min_age)
 
     def add_message(self, community, sender, text):
-        msgs = read_json(self.messages_path(community), {"messages": []})
-        msg = {"sender": sender, "text": text, "created": datetime.utcnow().isoformat()}
-        msgs["messages"].append(msg)
-        write_json(self.messages_path(community), msgs)
+        msg = self.message_log(community).append({"id": new_id(), "sender": sender, "text": text, "created": datetime.utcnow().isoformat()})
+        self.emit("message_added", community=community, message=msg)
         return msg
 
-    def list_messages(self, community):
-        return read_json(self.messages_path(community), {"messages": []})["messages"]
+    def list_messages(self, community, before=None, limit=50):
+        # newest page of messages older than seq `before`, oldest first
+        return self.message_log(community).page(before, limit)
+
+    def merge_remote(self, community, stream, records):
+        # records pulled by CommunitySync; returns the ones that were new here
+        if community not in self.index["communities"]:
+            self.create_community(community)
+        if stream == "posts":
+            for r in records:
+                blob = r.get("attachment_blob")
+                r["attachment"] = self.blobs.blob_path(blob) if blob and self.blobs.has(blob) else None
+            added = self.post_log(community).merge(records)
+            if added and self.search_index is not None:
+                self.search_index.index_docs([self.index_entry(community, p) for p in added])
+        else:
+            added = self.message_log(community).merge(records)
+        if added:
+            self.emit(f"{stream}_synced", community=community, count=len(added))
+        return added
+
+# ---------------- Background I/O ----------------
+class IOExecutor:
+    # Runs store calls off the UI thread. Calls submitted under the same key
+    # (a community, or all of notes) run one at a time in submission order;
+    # different keys share the `workers` threads, one call per turn, so a busy
+    # chat does not hold up a note save. submit() returns a Future and
+    # on_result / on_error run on the UI thread through `dispatch`.
+    def __init__(self, workers=2, dispatch=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='store-io')
+        self.dispatch = dispatch or (lambda fn: Clock.schedule_once(lambda dt: fn(), 0))
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.queues = {}; self.idle_callbacks = []
+
+    def submit(self, key, fn, *args, on_result=None, on_error=None, **kwargs):
+        fut = Future()
+        if on_result or on_error:
+            fut.add_done_callback(lambda f: self.deliver(f, on_result, on_error))
+        with self.lock:
+            queue = self.queues.get(key)
+            start = queue is None
+            if start:
+                queue = self.queues[key] = deque()
+            queue.append((fut, fn, args, kwargs))
+        if start:
+            self.pool.submit(self.run_next, key)
+        return fut
+
+    def run_next(self, key):
+        with self.lock:
+            fut, fn, args, kwargs = self.queues[key].popleft()
+        if fut.set_running_or_notify_cancel():
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+        with self.lock:
+            more = bool(self.queues[key])
+            if not more:
+                del self.queues[key]
+                self.idle.notify_all()
+            callbacks = [] if self.queues else self.idle_callbacks
+            if callbacks: self.idle_callbacks = []
+        for cb in callbacks:
+            cb()
+        if more:
+            try:
+                self.pool.submit(self.run_next, key)  # back of the line: other keys get a turn
+            except RuntimeError:
+                self.run_next(key)  # shutting down: finish this queue here
+
+    def deliver(self, fut, on_result, on_error):
+        if fut.cancelled():
+            return
+        error = fut.exception()
+        if error is None:
+            if on_result: self.dispatch(lambda: on_result(fut.result()))
+        elif on_error:
+            self.dispatch(lambda: on_error(error))
+
+    def when_idle(self, fn):
+        # fn() once everything queued so far has run: now if idle, else on the worker finishing last
+        with self.lock:
+            if self.queues:
+                self.idle_callbacks.append(fn); return
+        fn()
+
+    def wait_idle(self, timeout=5):
+        # blocks until everything queued so far has run (on pause / exit)
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.queues, timeout)
+
+    def shutdown(self, timeout=5):
+        self.wait_idle(timeout)
+        self.pool.shutdown(wait=False)
+
+COMMUNITY_INDEX_CALLS = ('create_community',)
+
+class AsyncStore:
+    # Future-returning view of a store for UI callbacks: facade.add_post(...,
+    # on_result=fn, on_error=fn) queues store.add_post on the IOExecutor under
+    # key(method, args) and returns the Future.
+    def __init__(self, store, executor, key):
+        self.store = store; self.executor = executor; self.key = key
+
+    def __getattr__(self, name):
+        fn = getattr(self.store, name)
+        def call(*args, on_result=None, on_error=None, **kwargs):
+            return self.executor.submit(self.key(name, args), fn, *args, on_result=on_result, on_error=on_error, **kwargs)
+        return call
+
+# ---------------- Community Sync ----------------
+SYNC_BATCH = 500
+SYNC_STREAMS = ("posts", "messages")
+
+class SyncError(Exception):
+    pass
+
+class CommunitySync:
+    # Delta sync of community posts and chat through a relay (see relay.py).
+    # Every record carries its author device, a per-device sequence number
+    # (dseq) and a Lamport clock (lc). One exchange pushes this device's
+    # records the relay has not acknowledged yet and pulls other devices'
+    # records after our relay cursor, SYNC_BATCH per stream, gzip both ways;
+    # rounds repeat until both sides are drained. Merging orders records by
+    # record_key, so every device ends up with the same sequence.
+    def __init__(self, store, relay_url, batch=SYNC_BATCH, timeout=15, dispatch=None):
+        self.store = store; self.url = relay_url
+        self.batch = batch; self.timeout = timeout
+        self.dispatch = dispatch or (lambda fn: Clock.schedule_once(lambda dt: fn(), 0))
+        self.busy = threading.Lock()
+        self._session = None
+        self.bytes_sent = self.bytes_received = 0
+
+    def session(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    def state_path(self, community):
+        return os.path.join(self.store.community_path(community), "sync.json")
+
+    def last_sync(self, community):
+        return read_json(self.state_path(community), {}).get("last_sync")
+
+    def outgoing(self, stream, rec):
+        # seq is local arrival order and attachment a local path
+        return {k: v for k, v in rec.items() if k not in ("seq", "attachment")}
+
+    def exchange(self, payload):
+        import gzip
+        body = gzip.compress(encode_json(payload))
+        try:
+            resp = self.session().post(self.url, data=body, timeout=self.timeout,
+                                       headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        except Exception as e:
+            raise SyncError(f"Relay unreachable: {e}")
+        if resp.status_code != 200:
+            raise SyncError(f"Relay error {resp.status_code}")
+        self.bytes_sent += len(body); self.bytes_received += len(resp.content)
+        return resp.json()
+
+    def sync(self, community):
+        logs = {"posts": self.store.post_log(community), "messages": self.store.message_log(community)}
+        for log in logs.values():
+            log.adopt()
+        state = read_json(self.state_path(community), {})
+        acked = state.setdefault("acked", {}); cursors = state.setdefault("cursors", {})
+        stats = {"pushed": 0, "pulled": 0}
+        while True:
+            streams = {}
+            for name, log in logs.items():
+                push = log.own_since(acked.get(name, 0), self.batch)
+                streams[name] = {"cursor": cursors.get(name, 0), "limit": self.batch,
+                                 "push": [self.outgoing(name, r) for r in push]}
+            resp = self.exchange({"device": self.store.device, "community": community, "streams": streams})
+            again = False
+            for name in SYNC_STREAMS:
+                r = resp["streams"][name]; sent = streams[name]["push"]
+                # the relay acknowledges the highest contiguous dseq it holds for us
+                progressed = r["acked"] > acked.get(name, 0)
+                stats["pushed"] += max(0, r["acked"] - acked.get(name, 0))
+                acked[name] = r["acked"]; cursors[name] = r["cursor"]
+                if r["records"]:
+                    stats["pulled"] += len(self.store.merge_remote(community, name, r["records"]))
+                again = again or r["more"] or (len(sent) == self.batch and progressed)
+            if not again:
+                break
+        state["last_sync"] = datetime.utcnow().isoformat()
+        write_json(self.state_path(community), state)
+        return stats
+
+    def sync_all(self, communities=None):
+        totals = {"pushed": 0, "pulled": 0}
+        with self.busy:
+            for c in communities or self.store.list_communities():
+                for k, v in self.sync(c).items():
+                    totals[k] += v
+        return totals
+
+    def start(self, communities=None, on_done=None):
+        # one round for every community on a background thread; on_done(stats, error) on the UI thread
+        if self.busy.locked():
+            return None
+        def work():
+            try:
+                res, err = self.sync_all(communities), None
+            except Exception as e:
+                res, err = None, e
+            if on_done: self.dispatch(lambda: on_done(res, err))
+        t = threading.Thread(target=work, name="community-sync", daemon=True)
+        t.start()
+        return t
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+# ---------------- Bulk Import ----------------
+IMPORT_EXTS = ('.txt', '.md')
+IMPORT_MAX_BYTES = 50 * 1024 * 1024
+IMPORT_INFLIGHT_BYTES = 16 * 1024 * 1024  # raw bytes being read/decoded at once
+IMPORT_BATCH_BYTES = 8 * 1024 * 1024      # decoded text waiting to be written
+
+def decode_text(raw):
+    # BOMs first, then strict UTF-8, then charset-normalizer's best guess when
+    # it is installed (it ships with requests) and the sample is big enough to
+    # guess from, then cp1252 / latin-1
+    for bom, enc in ((b'\xef\xbb\xbf', 'utf-8-sig'), (b'\xff\xfe', 'utf-16'), (b'\xfe\xff', 'utf-16')):
+        if raw.startswith(bom):
+            return raw.decode(enc, 'replace')
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    try:
+        if len(raw) < 1024:
+            raise ValueError
+        from charset_normalizer import from_bytes
+        matches = from_bytes(raw[:256 * 1024])
+        # single-byte Latin guesses are close calls; keep Western text in cp1252
+        if matches and 'cp1252' not in [m.encoding for m in matches]:
+            return raw.decode(matches.best().encoding, 'replace')
+    except Exception:
+        pass
+    try:
+        return raw.decode('cp1252')
+    except UnicodeDecodeError:
+        return raw.decode('latin-1')
+
+class NoteImporter:
+    # Imports every .txt/.md file under a directory or inside a zip archive.
+    # Files are read and decoded on a worker pool with at most `inflight`
+    # files / IMPORT_INFLIGHT_BYTES in flight; notes whose body already exists
+    # (by content hash) are skipped, and the rest are written to the store in
+    # batches of `batch` notes or IMPORT_BATCH_BYTES. Files over
+    # IMPORT_MAX_BYTES are listed in `oversized`. Progress and completion
+    # callbacks run on the UI thread; cancel() stops early.
+    def __init__(self, notes_store, folder, source, workers=3, inflight=8, batch=100, dispatch=None):
+        self.notes_store = notes_store; self.folder = folder; self.source = source
+        self.workers = workers; self.inflight = inflight; self.batch = batch
+        self.dispatch = dispatch or (lambda fn: Clock.schedule_once(lambda dt: fn(), 0))
+        self.cancelled = threading.Event()
+        self.local = threading.local()
+        self.zips = []; self.lock = threading.Lock()
+        self.total = self.done = self.imported = self.skipped = self.failed = 0
+        self.oversized = []
+
+    def entries(self):
+        import zipfile
+        if zipfile.is_zipfile(self.source):
+            with zipfile.ZipFile(self.source) as zf:
+                return [('zip', i.filename, i.file_size) for i in zf.infolist()
+                        if not i.is_dir() and i.filename.lower().endswith(IMPORT_EXTS)]
+        if os.path.isdir(self.source):
+            out = []
+            for root, dirs, files in os.walk(self.source):
+                dirs.sort()
+                for fname in sorted(files):
+                    if fname.lower().endswith(IMPORT_EXTS):
+                        p = os.path.join(root, fname)
+                        out.append(('file', p, os.path.getsize(p)))
+            return out
+        return [('file', self.source, os.path.getsize(self.source))]
+
+    def read(self, entry):
+        kind, name, size = entry
+        if self.cancelled.is_set():
+            return None
+        if kind == 'zip':
+            zf = getattr(self.local, 'zip', None)
+            if zf is None:
+                import zipfile
+                zf = self.local.zip = zipfile.ZipFile(self.source)  # one handle per worker thread, closed by run()
+                with self.lock:
+                    self.zips.append(zf)
+            raw = zf.read(name)
+        else:
+            with open(name, 'rb') as f:
+                raw = f.read()
+        body = decode_text(raw)
+        return os.path.basename(name), body, content_hash(body), size
+
+    def start(self, on_progress=None, on_done=None):
+        t = threading.Thread(target=self.run, args=(on_progress, on_done), name='note-import', daemon=True)
+        t.start()
+        return t
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self, on_progress=None, on_done=None):
+        error = None
+        try:
+            entries = self.entries()
+            self.total = len(entries)
+            seen = set(); pending = []; futures = []; size = {'pending': 0, 'inflight': 0}
+            def report():
+                if on_progress:
+                    done, imported, skipped = self.done, self.imported, self.skipped
+                    self.dispatch(lambda: on_progress(done, self.total, imported, skipped))
+            def flush():
+                hashes = {h for _, _, h, _ in pending}
+                known = self.notes_store.known_hashes(hashes)
+                fresh = [(title, body) for title, body, h, _ in pending if h not in known]
+                self.notes_store.save_notes(self.folder, fresh)
+                self.imported += len(fresh); self.skipped += len(pending) - len(fresh)
+                pending.clear(); size['pending'] = 0
+            def collect():
+                fut, nbytes = futures.pop(0)
+                size['inflight'] -= nbytes
+                try:
+                    res = fut.result()
+                except Exception:
+                    res = None; self.failed += 1
+                self.done += 1
+                if res is None:
+                    return
+                if res[2] in seen:
+                    self.skipped += 1
+                else:
+                    seen.add(res[2]); pending.append(res); size['pending'] += res[3]
+                if len(pending) >= self.batch or size['pending'] >= IMPORT_BATCH_BYTES:
+                    flush()
+                if self.done % 10 == 0 or self.done == self.total:
+                    report()
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import') as pool:
+                for entry in entries:
+                    if self.cancelled.is_set():
+                        break
+                    if entry[2] > IMPORT_MAX_BYTES:
+                        self.oversized.append(entry[1]); self.skipped += 1; self.done += 1
+                        continue
+                    # a file starts only once the ones before it leave room
+                    while futures and (len(futures) >= self.inflight or size['inflight'] + entry[2] > IMPORT_INFLIGHT_BYTES):
+                        collect()
+                    futures.append((pool.submit(self.read, entry), entry[2])); size['inflight'] += entry[2]
+                while futures:
+                    collect()
+            if pending:
+                flush()
+            report()
+        except Exception as e:
+            error = e
+        finally:
+            for zf in self.zips:
+                zf.close()
+        if on_done:
+            self.dispatch(lambda: on_done(self, error))
+
+# ---------------- Backups ----------------
+# caches and derived data are left out; the search index is rebuilt after a restore
+BACKUP_SKIP_DIRS = ('previews', 'restore-staging', os.path.join('blobs', 'tmp'))
+BACKUP_SKIP_FILES = ('search.db', 'ai_cache.db')
+BACKUP_SKIP_SUFFIXES = ('-wal', '-shm', '-journal', '.tmp', '.log', '.part')
+RESTORE_STAGING = 'restore-staging'
+
+class BackupError(Exception):
+    pass
+
+def backup_files(data_dir, exclude=()):
+    # (relpath, abspath) of every file a backup covers
+    skip = {os.path.join(data_dir, d) for d in BACKUP_SKIP_DIRS} | {os.path.realpath(e) for e in exclude}
+    for root, dirs, files in os.walk(data_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) not in skip and os.path.realpath(os.path.join(root, d)) not in skip)
+        for fname in sorted(files):
+            rel = os.path.relpath(os.path.join(root, fname), data_dir)
+            if rel in BACKUP_SKIP_FILES or fname.endswith(BACKUP_SKIP_SUFFIXES):
+                continue
+            yield rel.replace(os.sep, '/'), os.path.join(root, fname)
+
+class HashingReader:
+    # file wrapper for tarfile.addfile: hashes what it hands out, stops at
+    # `size` so a log appended to mid-backup still matches its tar header
+    def __init__(self, f, size, on_read=None):
+        self.f = f; self.left = size; self.on_read = on_read
+        self.sha = hashlib.sha256()
+
+    def read(self, n=-1):
+        n = self.left if n is None or n < 0 else min(n, self.left)
+        chunk = self.f.read(n)
+        self.left -= len(chunk); self.sha.update(chunk)
+        if self.on_read: self.on_read(len(chunk))
+        return chunk
+
+class BackupEngine:
+    # Incremental backups of the data dir into backup_dir. Each backup writes
+    # <id>.tar.gz with only the files that changed since the previous
+    # manifest (same size and mtime: unchanged; same size: compared by
+    # sha256), then <id>.json listing every file with its hash and the
+    # archive holding its content. The manifest is the commit point: an
+    # interrupted backup leaves at most a .part file. SQLite databases are
+    # snapshotted with the backup API rather than copied while open, and all
+    # data is streamed in BLOB_CHUNK pieces. Restores are staged next to the
+    # data and applied on the next start by apply_staged_restore().
+    def __init__(self, data_dir, backup_dir=None, dispatch=None):
+        self.data_dir = data_dir
+        self.backup_dir = backup_dir or os.path.join(data_dir, 'backups')
+        self.tmp = os.path.join(self.backup_dir, 'tmp')
+        ensure_dir(self.tmp)
+        self.dispatch = dispatch or (lambda fn: Clock.schedule_once(lambda dt: fn(), 0))
+        self.cancelled = threading.Event()
+        self.busy = threading.Lock()
+
+    def archive_path(self, bid):
+        return os.path.join(self.backup_dir, f'{bid}.tar.gz')
+
+    def manifest_path(self, bid):
+        return os.path.join(self.backup_dir, f'{bid}.json')
+
+    def list_backups(self):
+        return sorted(f[:-5] for f in os.listdir(self.backup_dir) if f.endswith('.json') and f[:-5].isdigit())
+
+    def manifest(self, bid):
+        m = read_json(self.manifest_path(bid), None)
+        if m is None:
+            raise BackupError(f'backup {bid} not found')
+        return m
+
+    def latest(self):
+        ids = self.list_backups()
+        return self.manifest(ids[-1]) if ids else None
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise BackupError('cancelled')
+
+    def signature(self, path):
+        st = os.stat(path)
+        sig = [st.st_size, st.st_mtime_ns]
+        if path.endswith('.db'):
+            try:
+                wal = os.stat(path + '-wal'); sig += [wal.st_size, wal.st_mtime_ns]
+            except OSError:
+                pass
+        return sig
+
+    def snapshot_db(self, path):
+        # consistent copy of a live database (WAL included) via the backup API
+        fd, snap = tempfile.mkstemp(dir=self.tmp, suffix='.snap'); os.close(fd)
+        src = sqlite3.connect(path); dst = sqlite3.connect(snap)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close(); src.close()
+        return snap
+
+    def hash_path(self, path, on_read=None):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(BLOB_CHUNK), b''):
+                self.check(); h.update(chunk)
+                if on_read: on_read(len(chunk))
+        return h.hexdigest()
+
+    def backup(self, progress=None):
+        import tarfile
+        with self.busy:
+            self.cancelled.clear()
+            flush_writes()
+            prev = self.latest()
+            prev_files = prev['files'] if prev else {}
+            files = list(backup_files(self.data_dir, exclude=(self.backup_dir,)))
+            total = sum(os.path.getsize(p) for _, p in files); done = [0]
+            def on_read(n):
+                done[0] += n
+                if progress: progress(done[0], total)
+            bid = new_id()
+            part = self.archive_path(bid) + '.part'
+            manifest = {'id': bid, 'parent': prev['id'] if prev else None,
+                        'created': datetime.utcnow().isoformat(), 'files': {}}
+            added = 0
+            try:
+                with open(part, 'wb') as raw:
+                    with tarfile.open(fileobj=raw, mode='w:gz', compresslevel=6) as tar:
+                        for rel, path in files:
+                            self.check()
+                            try:
+                                sig = self.signature(path)
+                            except OSError:
+                                continue  # removed while we were walking
+                            old = prev_files.get(rel)
+                            if old and old['sig'] == sig:
+                                manifest['files'][rel] = old; on_read(sig[0]); continue
+                            src = self.snapshot_db(path) if path.endswith('.db') else path
+                            try:
+                                entry = self.backup_file(tar, rel, src, sig, old, bid, on_read)
+                            finally:
+                                if src != path: os.remove(src)
+                            added += entry['archive'] == bid
+                            manifest['files'][rel] = entry
+                    raw.flush(); os.fsync(raw.fileno())
+                if added:
+                    os.replace(part, self.archive_path(bid))
+                else:
+                    os.remove(part)
+                manifest['archived'] = added
+                write_json(self.manifest_path(bid), manifest, sync=True)
+                return manifest
+            except BaseException:
+                if os.path.exists(part): os.remove(part)
+                raise
+
+    def backup_file(self, tar, rel, src, sig, old, bid, on_read):
+        import tarfile
+        with open(src, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if old and old['size'] == size:
+                # same size as last time: only archive it if the bytes differ
+                digest = self.hash_path(src)
+                if digest == old['sha256']:
+                    on_read(size)
+                    return dict(old, sig=sig, mtime=sig[1])
+            info = tarfile.TarInfo(rel)
+            info.size = size; info.mtime = sig[1] // 10**9
+            reader = HashingReader(f, size, lambda n: (self.check(), on_read(n)))
+            tar.addfile(info, reader)
+        return {'size': size, 'mtime': sig[1], 'sig': sig, 'sha256': reader.sha.hexdigest(), 'archive': bid}
+
+    def read_archives(self, manifest, wanted, on_member):
+        # streams every archive the manifest refers to once, in order, and
+        # calls on_member(rel, entry, fileobj) for the wanted files
+        import tarfile
+        by_archive = {}
+        for rel in wanted:
+            by_archive.setdefault(manifest['files'][rel]['archive'], set()).add(rel)
+        missing = []
+        for bid, rels in sorted(by_archive.items()):
+            path = self.archive_path(bid)
+            if not os.path.exists(path):
+                missing += sorted(rels); continue
+            with tarfile.open(path, mode='r|gz') as tar:
+                for member in tar:
+                    self.check()
+                    if member.isfile() and member.name in rels:
+                        rels.discard(member.name)
+                        on_member(member.name, manifest['files'][member.name], tar.extractfile(member))
+            missing += sorted(rels)
+        return missing
+
+    def verify(self, bid=None, progress=None):
+        # re-reads every archived file the backup needs; returns a list of problems
+        with self.busy:
+            self.cancelled.clear()
+            manifest = self.manifest(bid) if bid else self.latest()
+            if manifest is None:
+                return ['no backups']
+            total = sum(e['size'] for e in manifest['files'].values()); done = [0]
+            problems = []
+            def on_member(rel, entry, f):
+                h = hashlib.sha256()
+                for chunk in iter(lambda: f.read(BLOB_CHUNK), b''):
+                    h.update(chunk); done[0] += len(chunk)
+                    if progress: progress(done[0], total)
+                if h.hexdigest() != entry['sha256']:
+                    problems.append(f'{rel}: checksum mismatch')
+            missing = self.read_archives(manifest, list(manifest['files']), on_member)
+            return problems + [f'{rel}: missing from archive' for rel in missing]
+
+    def restore(self, bid, target, progress=None):
+        # writes the backup's files under target; each one goes to a temp
+        # file first and is only moved into place once its hash checks out
+        with self.busy:
+            self.cancelled.clear()
+            manifest = self.manifest(bid)
+            total = sum(e['size'] for e in manifest['files'].values()); done = [0]
+            root = os.path.realpath(target)
+            def on_member(rel, entry, f):
+                dest = os.path.realpath(os.path.join(root, rel))
+                if not dest.startswith(root + os.sep):
+                    raise BackupError(f'unsafe path in backup: {rel}')
+                ensure_dir(os.path.dirname(dest))
+                tmp = dest + '.part'; h = hashlib.sha256()
+                with open(tmp, 'wb') as out:
+                    for chunk in iter(lambda: f.read(BLOB_CHUNK), b''):
+                        h.update(chunk); out.write(chunk); done[0] += len(chunk)
+                        if progress: progress(done[0], total)
+                if h.hexdigest() != entry['sha256']:
+                    os.remove(tmp)
+                    raise BackupError(f'{rel}: checksum mismatch')
+                os.replace(tmp, dest)
+                os.utime(dest, ns=(entry['mtime'], entry['mtime']))
+            missing = self.read_archives(manifest, list(manifest['files']), on_member)
+            if missing:
+                raise BackupError(f'{len(missing)} files missing from backup archives, e.g. {missing[0]}')
+            return manifest
+
+    def stage_restore(self, bid, progress=None):
+        staging = os.path.join(self.data_dir, RESTORE_STAGING)
+        shutil.rmtree(staging, ignore_errors=True)
+        manifest = self.restore(bid, staging, progress)
+        write_json(os.path.join(staging, 'restore.json'), manifest, sync=True)
+        return manifest
+
+    def prune(self, keep=5):
+        # drops old manifests, then archives no remaining manifest refers to
+        ids = self.list_backups()
+        for bid in ids[:-keep] if keep else ids:
+            os.remove(self.manifest_path(bid))
+        used = {e['archive'] for bid in self.list_backups() for e in self.manifest(bid)['files'].values()}
+        for f in os.listdir(self.backup_dir):
+            if f.endswith('.tar.gz') and f[:-7] not in used:
+                os.remove(os.path.join(self.backup_dir, f))
+
+    def start(self, fn, *args, on_progress=None, on_done=None):
+        # runs backup/verify/stage_restore on a thread; callbacks run on the UI thread
+        last = [-1]
+        def progress(done, total):
+            pct = int(done * 100 / total) if total else 100
+            if on_progress and pct != last[0]:
+                last[0] = pct
+                self.dispatch(lambda: on_progress(pct))
+        def work():
+            try:
+                res, err = fn(*args, progress=progress), None
+            except Exception as e:
+                res, err = None, e
+            if on_done: self.dispatch(lambda: on_done(res, err))
+        t = threading.Thread(target=work, name='backup', daemon=True)
+        t.start()
+        return t
+
+    def cancel(self):
+        self.cancelled.set()
+
+def apply_staged_restore(data_dir, backup_dir=None):
+    # called before the stores open: swaps a staged restore into place,
+    # removes files the backup did not have and drops the search index.
+    # Safe to run again after a crash: files already moved out of staging
+    # are skipped, and restore.json goes last, with the staging dir.
+    staging = os.path.join(data_dir, RESTORE_STAGING)
+    manifest = read_json(os.path.join(staging, 'restore.json'), None)
+    if manifest is None:
+        return False
+    for rel, path in list(backup_files(data_dir, exclude=(backup_dir or os.path.join(data_dir, 'backups'),))):
+        if rel not in manifest['files']:
+            os.remove(path)
+    for rel in manifest['files']:
+        src = os.path.join(staging, rel); dest = os.path.join(data_dir, rel)
+        if not os.path.exists(src):
+            continue  # moved before an interrupted run
+        ensure_dir(os.path.dirname(dest))
+        # a stale WAL must never meet the restored database
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(dest + suffix): os.remove(dest + suffix)
+        os.replace(src, dest)
+    for suffix in ('', '-wal', '-shm'):
+        p = os.path.join(data_dir, 'search.db' + suffix)
+        if os.path.exists(p): os.remove(p)
+    os.remove(os.path.join(staging, 'restore.json'))
+    shutil.rmtree(staging, ignore_errors=True)
+    return True
+
+# ---------------- Search Index ----------------
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+TITLE_WEIGHT = 3
+MAX_PREFIX_EXPANSIONS = 16
+MAX_PREFIX_POSTINGS = 10000
+SEARCH_CACHE_KB = 32 * 1024
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall((text or "").lower()) if len(t) <= 40]
+
+def fts5_available():
+    db = sqlite3.connect(":memory:")
+    try:
+        db.execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        db.close()
+
+def open_search_index(db_path):
+    # FTS5 where this SQLite has it compiled in (desktop builds do, some
+    # mobile builds do not), else the plain-table index
+    return FtsSearchIndex(db_path) if fts5_available() else SearchIndex(db_path)
+
+class SearchIndex:
+    # Persistent inverted index over note titles/bodies and post text.
+    # docs has one row per indexed doc with its term list (for removal) and
+    # vocab the document frequency of every term, so prefix expansion can
+    # pick the most frequent completions. Postings are keyed by (term, id)
+    # so exact and prefix lookups are range scans; a batch writes them sorted
+    # by term, which keeps inserts near each other in the b-tree. Ranking is
+    # BM25 with title terms counted TITLE_WEIGHT times.
+    FTS = 0
+
+    def __init__(self, db_path):
+        ensure_dir(os.path.dirname(db_path))
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(f"PRAGMA cache_size=-{SEARCH_CACHE_KB}")
+        columns = [r["name"] for r in self.db.execute("PRAGMA table_info(docs)")]
+        if columns and ("terms" not in columns or self.stat("fts") != self.FTS):
+            # an older layout, or postings kept by the other index: derived data, so start over
+            self.db.executescript("DROP TABLE docs; DROP TABLE IF EXISTS vocab; DROP TABLE IF EXISTS stats;")
+            self.drop_postings()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY, doc TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, ref TEXT NOT NULL,
+                title TEXT NOT NULL, snippet TEXT NOT NULL, length INTEGER NOT NULL, terms TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS vocab (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+        self.create_postings()
+        self.db.execute("INSERT OR REPLACE INTO stats(key, value) VALUES('fts', ?)", (self.FTS,))
+        self.db.commit()
+        self.built = self.stat("built") == 1
+        self.cancelled = threading.Event()
+
+    def create_postings(self):
+        self.db.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, id INTEGER NOT NULL, tf INTEGER NOT NULL, "
+                        "dl INTEGER NOT NULL, PRIMARY KEY (term, id)) WITHOUT ROWID")
+
+    def drop_postings(self):
+        self.db.execute("DROP TABLE IF EXISTS postings")
+
+    def stat(self, key):
+        row = self.db.execute("SELECT value FROM stats WHERE key=?", (key,)).fetchone()
+        return row["value"] if row else 0
+
+    def bump_stat(self, key, delta):
+        self.db.execute("INSERT INTO stats(key, value) VALUES(?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value=value+excluded.value", (key, delta))
+
+    def is_built(self):
+        # False until the first rebuild finishes; search() answers from a partial index until then
+        return self.built
+
+    def mark_built(self):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO stats(key, value) VALUES('built', 1)")
+        self.built = True
+
+    def indexed(self, docs):
+        found = set()
+        for i in range(0, len(docs), 500):
+            chunk = docs[i:i + 500]
+            found.update(r["doc"] for r in self.db.execute(
+                f"SELECT doc FROM docs WHERE doc IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def _remove(self, doc):
+        row = self.db.execute("SELECT id, length, terms FROM docs WHERE doc=?", (doc,)).fetchone()
+        if row is None:
+            return
+        terms = sorted(row["terms"].split())
+        self.db.executemany("UPDATE vocab SET df=df-1 WHERE term=?", [(t,) for t in terms])
+        self.remove_postings(row["id"], terms)
+        self.db.execute("DELETE FROM docs WHERE id=?", (row["id"],))
+        self.bump_stat("docs", -1); self.bump_stat("total_len", -row["length"])
+
+    def remove_postings(self, doc_id, terms):
+        self.db.executemany("DELETE FROM postings WHERE term=? AND id=?", [(t, doc_id) for t in terms])
+
+    def add_postings(self, entries):
+        # entries: (id, title, body, counts, length) per doc
+        postings = sorted((t, doc_id, tf, length) for doc_id, _, _, counts, length in entries for t, tf in counts.items())
+        self.db.executemany("INSERT INTO postings(term, id, tf, dl) VALUES(?, ?, ?, ?)", postings)
+
+    def index_doc(self, doc, kind, ref, title, body):
+        self.index_docs([(doc, kind, ref, title, body)])
+
+    def index_docs(self, docs, keep_existing=False):
+        # (re)index a batch of (doc, kind, ref, title, body) in one transaction;
+        # with keep_existing, docs already in the index are left as they are
+        docs = list({d[0]: d for d in docs}.values())
+        entries = []; dfs = {}; total = 0
+        with self.lock, self.db:
+            existing = self.indexed([d[0] for d in docs])
+            for doc, kind, ref, title, body in docs:
+                if doc in existing:
+                    if keep_existing:
+                        continue
+                    self._remove(doc)
+                counts = {}
+                for t in tokenize(title):
+                    counts[t] = counts.get(t, 0) + TITLE_WEIGHT
+                for t in tokenize(body):
+                    counts[t] = counts.get(t, 0) + 1
+                length = sum(counts.values()); total += length
+                cur = self.db.execute("INSERT INTO docs(doc, kind, ref, title, snippet, length, terms) VALUES(?, ?, ?, ?, ?, ?, ?)",
+                                      (doc, kind, ref, title or "", (body or "")[:SNIPPET_LEN], length, " ".join(counts)))
+                entries.append((cur.lastrowid, title or "", body or "", counts, length))
+                for t in counts:
+                    dfs[t] = dfs.get(t, 0) + 1
+            self.add_postings(entries)
+            self.db.executemany("INSERT INTO vocab(term, df) VALUES(?, ?) "
+                                "ON CONFLICT(term) DO UPDATE SET df=df+excluded.df", sorted(dfs.items()))
+            self.bump_stat("docs", len(entries)); self.bump_stat("total_len", total)
+
+    def remove_doc(self, doc):
+        with self.lock, self.db:
+            self._remove(doc)
+
+    def rebuild(self, notes_store, community_store, batch=500):
+        # first run / upgrade / restore; runs in the background, so docs that
+        # saves indexed meanwhile (or an interrupted rebuild left) are kept.
+        # Returns False when cancel() stopped it; the next launch carries on
+        docs = []
+        for n in notes_store.iter_notes():
+            docs.extend(notes_store.index_entries(n["id"], n["title"], n["parts"]))
+            if len(docs) >= batch:
+                if self.cancelled.is_set():
+                    return False
+                self.index_docs(docs, keep_existing=True); docs = []
+        for c in community_store.list_communities():
+            docs.extend(community_store.index_entry(c, post) for post in community_store.iter_posts(c))
+        self.index_docs(docs, keep_existing=True)
+        self.mark_built()
+        return True
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def expand(self, token, prefix):
+        if not prefix:
+            row = self.db.execute("SELECT df FROM vocab WHERE term=? AND df>0", (token,)).fetchone()
+            return [(token, row["df"])] if row else []
+        # the token itself, then its most frequent completions until their
+        # posting lists get too long to score while typing
+        terms = self.expand(token, prefix=False); postings = sum(df for _, df in terms)
+        rows = self.db.execute("SELECT term, df FROM vocab WHERE term>? AND term<? AND df>0 ORDER BY df DESC LIMIT ?",
+                               (token, token + "\uffff", MAX_PREFIX_EXPANSIONS))
+        for r in rows:
+            if terms and postings + r["df"] > MAX_PREFIX_POSTINGS:
+                break
+            terms.append((r["term"], r["df"])); postings += r["df"]
+        return terms
+
+    def search(self, query, limit=20, kind=None):
+        # every query token must match; the last one also matches as a prefix
+        # so results follow the user while typing
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self.lock:
+            groups = []
+            uniq = list(dict.fromkeys(tokens))
+            for i, tok in enumerate(uniq):
+                terms = self.expand(tok, prefix=(i == len(uniq) - 1))
+                if not terms:
+                    return []
+                groups.append((tok, terms))
+            # rarest token first keeps the candidate set small
+            groups.sort(key=lambda g: sum(df for _, df in g[1]))
+            results = []
+            for doc_id, score in self.rank(groups, limit, kind):
+                row = self.db.execute("SELECT doc, kind, ref, title, snippet FROM docs WHERE id=?", (doc_id,)).fetchone()
+                if row is None or (kind and row["kind"] != kind):
+                    continue
+                res = dict(row); res["score"] = score
+                results.append(res)
+                if len(results) >= limit:
+                    break
+            return results
+
+    def rank(self, groups, limit, kind):
+        # (id, score) best first; each token group scores a doc by its
+        # best-matching term, computed in SQL
+        k1, b = 1.2, 0.75
+        n_docs = max(self.stat("docs"), 1)
+        avg_len = max(self.stat("total_len") / n_docs, 1.0)
+        cur = self.db.cursor(); cur.row_factory = None
+        top = len(groups) == 1 and not kind
+        scores = None
+        for tok, terms in groups:
+            cases = []
+            for term, df in terms:
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                cases.append(term); cases.append(idf * 0.8 if term != tok else idf)  # prefix completions rank below exact hits
+            sql = (f"SELECT id, MAX((CASE term {'WHEN ? THEN ? ' * len(terms)}END) * tf * {k1 + 1} / "
+                   f"(tf + {k1} * (1 - {b} + {b} * dl / ?))) AS sc FROM postings WHERE term IN ({','.join('?' * len(terms))})")
+            params = cases + [avg_len] + [t for t, _ in terms]
+            if scores is not None and len(scores) <= 500:
+                sql += f" AND id IN ({','.join('?' * len(scores))})"; params.extend(scores)
+            sql += " GROUP BY id"
+            if top:
+                sql += " ORDER BY sc DESC LIMIT ?"; params.append(limit)
+            part = dict(cur.execute(sql, params))
+            if scores is None:
+                scores = part
+            else:
+                scores = {d: sc + part[d] for d, sc in scores.items() if d in part}
+            if not scores:
+                return []
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+class FtsSearchIndex(SearchIndex):
+    # Same index with the postings in an SQLite FTS5 table keyed by docs.id:
+    # FTS5 buffers and merges its segments itself, so large batches and
+    # large indexes stay cheap, and BM25 (bm25(), titles weighted
+    # TITLE_WEIGHT) runs inside SQLite. docs/vocab still drive prefix
+    # expansion, so a short prefix matches its most frequent completions
+    # instead of every term it starts.
+    FTS = 1
+
+    def create_postings(self):
+        self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(title, body, "
+                        "tokenize=\"unicode61 remove_diacritics 0 tokenchars '_'\")")
+
+    def drop_postings(self):
+        self.db.execute("DROP TABLE IF EXISTS postings")
+        self.db.execute("DROP TABLE IF EXISTS fts")
+
+    def remove_postings(self, doc_id, terms):
+        self.db.execute("DELETE FROM fts WHERE rowid=?", (doc_id,))
+
+    def add_postings(self, entries):
+        self.db.executemany("INSERT INTO fts(rowid, title, body) VALUES(?, ?, ?)",
+                            [(doc_id, title, body) for doc_id, title, body, _, _ in entries])
+
+    def rank(self, groups, limit, kind):
+        match = " AND ".join("(" + " OR ".join(f'"{t}"' for t, _ in terms) + ")" for _, terms in groups)
+        join, params = (" JOIN docs d ON d.id=fts.rowid AND d.kind=?", [kind]) if kind else ("", [])
+        rows = self.db.execute(f"SELECT fts.rowid AS id, bm25(fts, {TITLE_WEIGHT}, 1.0) AS r FROM fts{join} "
+                               "WHERE fts MATCH ? ORDER BY r LIMIT ?", params + [match, limit])
+        return [(r["id"], -r["r"]) for r in rows]
+
+# ---------------- Autocomplete ----------------
+HISTORY_MAX = 500
+FRECENCY_HALF_LIFE = 14 * 24 * 3600
+SUGGEST_CANDIDATES = 256
+SUGGEST_WORDS = 8
+
+def suggest_key(text):
+    return " ".join(tokenize(text))
+
+class Autocomplete:
+    # Prefix index over AI search history and note titles. Each kind has a
+    # sorted list of (normalised text from each of its first words on, eid),
+    # so "anat" finds "Human Anatomy" with one bisect and a short scan.
+    # Candidates rank by frecency - a use count that halves every
+    # FRECENCY_HALF_LIFE - then by recency. Entries and keys live in
+    # autocomplete.db and come back already sorted, so nothing is
+    # re-tokenized at startup; history loads at once, note titles on a
+    # background thread (lookups before that see history only).
+    def __init__(self, db_path):
+        ensure_dir(os.path.dirname(db_path))
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                eid TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                ref TEXT,
+                score REAL NOT NULL,
+                last REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS keys (
+                key TEXT NOT NULL,
+                eid TEXT NOT NULL,
+                PRIMARY KEY (key, eid)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.db.commit()
+        self.entries, history_keys = self.read_kind(self.db, "q:")
+        self.keys = {"history": history_keys, "note": []}
+        self.touched = set()  # note eids changed before the background load finished
+        self.notes_loaded = threading.Event()
+        threading.Thread(target=self.load_notes, name="autocomplete-load", daemon=True).start()
+
+    @staticmethod
+    def read_kind(db, prefix):
+        # eids are "q:<text>" / "n:<note id>"; SQLite's binary collation
+        # orders keys the same way Python compares strings
+        hi = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        entries = {r[0]: [r[1], r[2], r[3], r[4], r[5]] for r in db.execute(
+            "SELECT eid, text, kind, ref, score, last FROM entries WHERE eid>=? AND eid<?", (prefix, hi))}
+        keys = db.execute("SELECT key, eid FROM keys WHERE eid>=? AND eid<? ORDER BY key, eid", (prefix, hi)).fetchall()
+        return entries, keys
+
+    def load_notes(self):
+        db = sqlite3.connect(self.db_path)
+        try:
+            entries, keys = self.read_kind(db, "n:")
+        finally:
+            db.close()
+        with self.lock:
+            for eid, e in entries.items():
+                if eid not in self.touched:
+                    self.entries[eid] = e
+            keys = [k for k in keys if k[1] not in self.touched] if self.touched else keys
+            if self.keys["note"]:
+                keys = sorted(keys + self.keys["note"])
+            self.keys["note"] = keys; self.touched = set()
+            self.notes_loaded.set()
+
+    def get_flag(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM kv WHERE key=?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def set_flag(self, key, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO kv(key, value) VALUES(?, ?)", (key, value))
+
+    @staticmethod
+    def keys_for(text):
+        words = suggest_key(text).split()
+        return {" ".join(words[i:]) for i in range(min(len(words), SUGGEST_WORDS))}
+
+    @staticmethod
+    def frecency(entry, now):
+        return entry[3] * 0.5 ** ((now - entry[4]) / FRECENCY_HALF_LIFE)
+
+    def drop_keys(self, kind, pairs):
+        keys = self.keys[kind]
+        for k in pairs:
+            i = bisect_left(keys, k)
+            if i < len(keys) and keys[i] == k:
+                del keys[i]
+
+    def put_many(self, items):
+        # items: (eid, text, kind, ref, score, last); re-keys entries whose text changed
+        rekeyed = []
+        with self.lock, self.db:
+            for eid, text, kind, ref, score, last in items:
+                old = self.entries.get(eid)
+                if not self.notes_loaded.is_set() and kind == "note":
+                    self.touched.add(eid)
+                if old is None or old[0] != text:
+                    old_keys = self.keys_for(old[0]) if old else set()
+                    new_keys = self.keys_for(text)
+                    self.drop_keys(kind, [(k, eid) for k in old_keys - new_keys])
+                    rekeyed.append((eid, kind, [(k, eid) for k in new_keys - old_keys], new_keys))
+                self.entries[eid] = [text, kind, ref, score, last]
+            self.db.executemany("INSERT OR REPLACE INTO entries(eid, text, kind, ref, score, last) VALUES(?, ?, ?, ?, ?, ?)", items)
+            self.db.executemany("DELETE FROM keys WHERE eid=?", [(eid,) for eid, _, _, _ in rekeyed])
+            self.db.executemany("INSERT INTO keys(key, eid) VALUES(?, ?)", [(k, eid) for eid, _, _, keys in rekeyed for k in keys])
+            for kind in ("history", "note"):
+                added = [k for _, knd, new, _ in rekeyed if knd == kind for k in new]
+                if len(added) > 64:
+                    self.keys[kind].extend(added); self.keys[kind].sort()  # bulk load: one sort beats many inserts
+                else:
+                    for k in added:
+                        insort(self.keys[kind], k)
+
+    def remove(self, eids):
+        with self.lock, self.db:
+            for eid in eids:
+                old = self.entries.pop(eid, None)
+                if old is None:
+                    continue
+                self.drop_keys(old[1], [(k, eid) for k in self.keys_for(old[0])])
+                self.db.execute("DELETE FROM keys WHERE eid=?", (eid,))
+                self.db.execute("DELETE FROM entries WHERE eid=?", (eid,))
+
+    def record_query(self, text, now=None):
+        # one more use of a search-history entry
+        key = suggest_key(text)
+        if not key:
+            return
+        now = now or time.time(); eid = "q:" + key
+        with self.lock:
+            old = self.entries.get(eid)
+            self.put_many([(eid, text.strip(), "history", None, (self.frecency(old, now) if old else 0) + 1, now)])
+            history = [e for e in self.entries if e.startswith("q:")]
+            if len(history) > HISTORY_MAX:
+                history.sort(key=lambda e: self.frecency(self.entries[e], now))
+                self.remove(history[:len(history) - HISTORY_MAX])
+
+    def import_history(self, topics, now=None):
+        # legacy ai_search_history.json list, newest first
+        now = now or time.time()
+        for i, topic in enumerate(reversed(topics)):
+            self.record_query(topic, now - len(topics) + i)
+
+    def seed(self, notes, history_path):
+        # first run / upgrade: existing note titles and the old history list.
+        # Flagged only once both are in, so a seed cut short runs again
+        self.add_notes(notes)
+        self.import_history(read_json(history_path, {"history": []})["history"])
+        self.set_flag("seeded", "1")
+
+    def add_notes(self, notes):
+        # (note_id, title, created) rows; new titles start below any searched topic
+        items = []
+        with self.lock:
+            for note_id, title, created in notes:
+                if not suggest_key(title):
+                    continue
+                old = self.entries.get("n:" + note_id)
+                if old:
+                    items.append(("n:" + note_id, title, "note", note_id, old[3], old[4]))
+                else:
+                    try:
+                        last = datetime.fromisoformat(created).timestamp()
+                    except (TypeError, ValueError):
+                        last = time.time()
+                    items.append(("n:" + note_id, title, "note", note_id, 0.5, last))
+            self.put_many(items)
+
+    def touch(self, eid, now=None):
+        now = now or time.time()
+        with self.lock:
+            e = self.entries.get(eid)
+            if e is not None:
+                self.put_many([(eid, e[0], e[1], e[2], self.frecency(e, now) + 1, now)])
+
+    def lookup(self, prefix, limit=8, kind=None):
+        key = suggest_key(prefix)
+        if not key:
+            return []
+        if prefix[-1:].isspace():
+            key += " "  # "human " should not match "humanities"
+        now = time.time()
+        with self.lock:
+            cands = set()
+            # history is capped at HISTORY_MAX, so its matches are all considered
+            for knd in ("history", "note") if kind is None else (kind,):
+                keys = self.keys[knd]; cap = len(cands) + SUGGEST_CANDIDATES
+                i = bisect_left(keys, (key,))
+                while i < len(keys) and len(cands) < cap and keys[i][0].startswith(key):
+                    cands.add(keys[i][1]); i += 1
+            ranked = sorted(((self.frecency(self.entries[e], now), self.entries[e][4], e) for e in cands), reverse=True)
+            out, seen = [], set()
+            for _, _, eid in ranked:
+                text, ekind, ref = self.entries[eid][:3]
+                if text.lower() in seen:
+                    continue
+                seen.add(text.lower())
+                out.append({"topic": text, "kind": ekind, "ref": ref, "eid": eid})
+                if len(out) >= limit:
+                    break
+            return out
+
+    def history(self, limit=50):
+        now = time.time()
+        with self.lock:
+            rows = sorted(((self.frecency(e, now), e[4], e[0]) for eid, e in self.entries.items() if eid.startswith("q:")), reverse=True)
+        return [text for _, _, text in rows[:limit]]
+
+# ---------------- AI Client ----------------
+AI_ENDPOINT = 'https://api.openai.com/v1/chat/completions'
+AI_MODEL = 'gpt-3.5-turbo'
+AI_BATCH_WORKERS = 3  # FolderSummarizer default, config key ai_batch_workers
+
+def status_message(status):
+    hint = {401: 'check openai_api_key in config.json', 403: 'access denied', 404: 'check openai_endpoint / openai_model',
+            429: 'rate limited, try again shortly'}.get(status) or ('service unavailable' if status >= 500 else '')
+    return f"AI request failed (status {status}{': ' + hint if hint else ''})"
+
+class AIError(Exception):
+    # status: HTTP status of a failed request; retry_after: seconds the
+    # server asked us to wait (429/503), when it said so
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status; self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status in (408, 409, 429) or (self.status or 0) >= 500
+
+class ResponseCache:
+    # Disk-backed AI response cache keyed by a hash of the full request body
+    # (model, prompt, parameters). Entries expire after `ttl` seconds and the
+    # least recently used ones are evicted once the total exceeds max_bytes.
+    def __init__(self, db_path, ttl=7 * 24 * 3600, max_bytes=5 * 1024 * 1024):
+        ensure_dir(os.path.dirname(db_path))
+        self.ttl = ttl; self.max_bytes = max_bytes
+        self.hits = 0; self.misses = 0
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,
+                created REAL NOT NULL, last_used REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_used);
+        """)
+        self.db.commit()
+
+    @staticmethod
+    def key_for(body):
+        return hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT value, created FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            with self.db:
+                self.db.execute("UPDATE entries SET last_used=? WHERE key=?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO entries(key, value, size, created, last_used) VALUES(?, ?, ?, ?, ?)",
+                            (key, value, size, now, now))
+            self.db.execute("DELETE FROM entries WHERE created<?", (now - self.ttl,))
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                for k, sz in self.db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self.db.execute("DELETE FROM entries WHERE key=?", (k,))
+                    total -= sz
+
+    def stats(self):
+        with self.lock:
+            count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": size}
+
+class AIClient:
+    # Runs chat-completion requests on a small worker pool over one pooled
+    # HTTP session, so the UI thread never waits on the network. Results are
+    # handed back through `dispatch` (Clock on the UI thread by default).
+    # Each submit() on a channel supersedes the previous one: a request that
+    # has not started yet is cancelled, and a late result is dropped.
+    # With a ResponseCache, repeated requests are answered from disk, and
+    # identical requests already in flight share one upstream call.
+    def __init__(self, config_path, workers=2, dispatch=None, cache=None):
+        self.config_path = config_path
+        self.cache = cache
+        self.inflight = {}
+        self.workers = workers
+        self.dispatch = dispatch or (lambda fn: Clock.schedule_once(lambda dt: fn(), 0))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai')
+        self.lock = threading.Lock()
+        self._config = None
+        self._session = None
+        self.generations = {}
+        self.pending = {}
+        self.streams = {}
+
+    def config(self):
+        if self._config is None:
+            self._config = read_json(self.config_path, {})
+        return self._config
+
+    def reload_config(self):
+        self._config = None
+
+    @property
+    def api_key(self):
+        return self.config().get('openai_api_key')
+
+    def session(self):
+        import requests
+        with self.lock:
+            if self._session is None:
+                self._session = requests.Session()
+                # the AI pool and a FolderSummarizer batch can be posting at the same time
+                batch = self.config().get('ai_batch_workers', AI_BATCH_WORKERS)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers + batch)
+                self._session.mount('https://', adapter); self._session.mount('http://', adapter)
+            return self._session
+
+    def request_body(self, prompt, max_tokens=150):
+        return {'model': self.config().get('openai_model', AI_MODEL),
+                'messages': [{'role': 'user', 'content': prompt}], 'max_tokens': max_tokens}
+
+    def post(self, body, timeout=10):
+        cfg = self.config()
+        headers = {'Authorization': f"Bearer {cfg.get('openai_api_key', '')}", 'Content-Type': 'application/json'}
+        resp = self.session().post(cfg.get('openai_endpoint', AI_ENDPOINT), headers=headers, json=body, timeout=timeout)
+        if resp.status_code != 200:
+            try:
+                retry_after = float(resp.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                retry_after = None
+            raise AIError(status_message(resp.status_code), resp.status_code, retry_after)
+        try:
+            return resp.json()['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise AIError('AI request failed (malformed response)')
+
+    def cached(self, prompt, max_tokens=150):
+        # cache lookup only; cheap enough to call on the UI thread
+        if self.cache is None:
+            return None
+        return self.cache.get(ResponseCache.key_for(self.request_body(prompt, max_tokens)))
+
+    def complete(self, prompt, max_tokens=150, timeout=10):
+        # blocking call; use submit() from UI code
+        hit = self.cached(prompt, max_tokens)
+        return hit if hit is not None else self.fetch(prompt, max_tokens, timeout)
+
+    def fetch(self, prompt, max_tokens=150, timeout=10):
+        # upstream call, shared by identical concurrent requests and cached
+        body = self.request_body(prompt, max_tokens)
+        if self.cache is None:
+            return self.post(body, timeout)
+        key = ResponseCache.key_for(body)
+        with self.lock:
+            shared = self.inflight.get(key)
+            if shared is None:
+                self.inflight[key] = own = Future()
+        if shared is not None:
+            return shared.result()
+        try:
+            text = self.post(body, timeout)
+            self.cache.put(key, text)
+            own.set_result(text)
+            return text
+        except Exception as e:
+            own.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def is_current(self, channel, gen):
+        return self.generations.get(channel) == gen
+
+    def begin(self, channel):
+        # start a new generation on `channel`, abandoning whatever was running
+        with self.lock:
+            gen = self.generations.get(channel, 0) + 1
+            self.generations[channel] = gen
+            prev = self.pending.pop(channel, None)
+            resp = self.streams.pop(channel, None)
+        if prev is not None:
+            prev.cancel()
+        if resp is not None:
+            try: resp.close()
+            except Exception: pass
+        return gen
+
+    def track(self, channel, gen, fut):
+        with self.lock:
+            if self.generations.get(channel) == gen:
+                self.pending[channel] = fut
+        return fut
+
+    def submit(self, prompt, on_result, on_error=None, channel='search', max_tokens=150):
+        hit = self.cached(prompt, max_tokens)
+        if hit is not None:
+            self.cancel(channel)
+            on_result(hit)
+            return None
+        gen = self.begin(channel)
+        def work():
+            if not self.is_current(channel, gen):
+                return
+            try:
+                text = self.fetch(prompt, max_tokens)
+                if self.is_current(channel, gen):
+                    self.dispatch(lambda: on_result(text))
+            except Exception as e:
+                if on_error and self.is_current(channel, gen):
+                    self.dispatch(lambda e=e: on_error(e))  # `e` is unbound once the except block ends
+        return self.track(channel, gen, self.executor.submit(work))
+
+    def stream(self, prompt, on_delta, on_done=None, on_error=None, channel='search', max_tokens=150, timeout=10):
+        # Streams the completion as server-sent events. Deltas arriving between
+        # two frames are coalesced, so the UI gets at most one on_delta per
+        # frame. A newer begin() on the channel closes the connection.
+        hit = self.cached(prompt, max_tokens)
+        if hit is not None:
+            self.cancel(channel)
+            on_delta(hit)
+            if on_done: on_done(hit)
+            return None
+        gen = self.begin(channel)
+        body = dict(self.request_body(prompt, max_tokens), stream=True)
+        pending = []
+        def flush():
+            with self.lock:
+                text = ''.join(pending); pending.clear()
+            if text and self.is_current(channel, gen):
+                on_delta(text)
+        def work():
+            if not self.is_current(channel, gen):
+                return
+            parts = []
+            try:
+                cfg = self.config()
+                headers = {'Authorization': f"Bearer {cfg.get('openai_api_key', '')}", 'Content-Type': 'application/json',
+                           'Accept': 'text/event-stream'}
+                resp = self.session().post(cfg.get('openai_endpoint', AI_ENDPOINT), headers=headers, json=body,
+                                           timeout=timeout, stream=True)
+                with self.lock:
+                    if self.generations.get(channel) != gen:
+                        resp.close(); return
+                    self.streams[channel] = resp
+                try:
+                    if resp.status_code != 200:
+                        raise AIError(status_message(resp.status_code), resp.status_code)
+                    for raw in resp.iter_lines():
+                        if not self.is_current(channel, gen):
+                            return
+                        line = raw.decode('utf-8', 'replace').strip()
+                        if not line.startswith('data:'):
+                            continue
+                        data = line[5:].strip()
+                        if data == '[DONE]':
+                            break
+                        try:
+                            delta = json.loads(data)['choices'][0].get('delta', {}).get('content') or ''
+                        except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                            continue
+                        if delta:
+                            parts.append(delta)
+                            with self.lock:
+                                first = not pending
+                                pending.append(delta)
+                            if first:
+                                self.dispatch(flush)
+                finally:
+                    resp.close()
+                    with self.lock:
+                        if self.streams.get(channel) is resp:
+                            del self.streams[channel]
+                full = ''.join(parts)
+                if self.cache is not None and full:
+                    self.cache.put(ResponseCache.key_for(self.request_body(prompt, max_tokens)), full)
+                if self.is_current(channel, gen):
+                    self.dispatch(lambda: (flush(), on_done and on_done(full)))
+            except Exception as e:
+                if on_error and self.is_current(channel, gen):
+                    self.dispatch(lambda e=e: on_error(e))
+        return self.track(channel, gen, self.executor.submit(work))
+
+    def cancel(self, channel='search'):
+        self.begin(channel)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self._session is not None:
+            self._session.close()
+
+# ---------------- Batch Summaries ----------------
+SUMMARY_CHUNK_CHARS = 8000
+SUMMARY_MAX_CHARS = 200_000
+SUMMARY_TOKENS = 200
+
+class TokenBucket:
+    # Request rate limiter shared by the worker threads: holds up to `burst`
+    # tokens, refilled at `rate` per second; take() blocks until one is free
+    # or `cancelled` is set (then returns False).
+    def __init__(self, rate, burst=1):
+        self.rate = rate; self.burst = burst
+        self.tokens = float(burst); self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, cancelled=None):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate); self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if cancelled is None:
+                time.sleep(wait)
+            elif cancelled.wait(wait):
+                return False
+
+def is_transient(error):
+    # worth retrying: rate limits, server errors, timeouts and dropped connections
+    if isinstance(error, AIError):
+        return error.retryable
+    try:
+        import requests
+    except ImportError:
+        return False
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+class FolderSummarizer:
+    # Summarizes every note of a folder, or the notes in `note_ids`, through the
+    # AIClient: `workers` notes at a time, every upstream request paced by a
+    # token bucket and retried with jittered exponential backoff on transient
+    # errors. Bodies over SUMMARY_CHUNK_CHARS are summarized piece by piece
+    # and the pieces combined. Summaries are stored on the note with the
+    # content hash they were made from, so unchanged notes are skipped next
+    # time. on_progress / on_result / on_done run on the UI thread.
+    def __init__(self, ai_client, notes_store, folder, note_ids=None, workers=AI_BATCH_WORKERS, rate_per_min=60, burst=3,
+                 retries=4, backoff=1.0, max_backoff=30.0, timeout=30, force=False, dispatch=None):
+        self.ai = ai_client; self.notes_store = notes_store; self.folder = folder; self.note_ids = note_ids
+        self.workers = workers; self.retries = retries; self.backoff = backoff; self.max_backoff = max_backoff
+        self.timeout = timeout; self.force = force
+        self.bucket = TokenBucket(rate_per_min / 60.0, burst)
+        self.dispatch = dispatch or (lambda fn: Clock.schedule_once(lambda dt: fn(), 0))
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.total = self.done = self.summarized = self.skipped = self.failed = self.requests = self.retried = 0
+        self.errors = {}
+
+    def start(self, on_progress=None, on_result=None, on_done=None):
+        t = threading.Thread(target=self.run, args=(on_progress, on_result, on_done), name='summarize', daemon=True)
+        t.start()
+        return t
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def ask(self, prompt):
+        # one completion: cache first, then paced and retried upstream calls
+        hit = self.ai.cached(prompt, SUMMARY_TOKENS)
+        if hit is not None:
+            return hit
+        for attempt in range(self.retries + 1):
+            if not self.bucket.take(self.cancelled):
+                return None
+            with self.lock:
+                self.requests += 1
+            try:
+                return self.ai.fetch(prompt, SUMMARY_TOKENS, self.timeout)
+            except Exception as e:
+                if attempt == self.retries or not is_transient(e):
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if getattr(e, 'retry_after', None):
+                    delay = max(delay, min(e.retry_after, self.max_backoff))
+                with self.lock:
+                    self.retried += 1
+                if self.cancelled.wait(delay):
+                    return None
+
+    def note_text(self, note_id):
+        # body pieces up to SUMMARY_MAX_CHARS, read from the store one stored piece at a time
+        text = []; size = 0
+        for seq in self.notes_store.chunk_seqs(note_id):
+            piece = self.notes_store.read_chunk(note_id, seq)
+            text.append(piece[:SUMMARY_MAX_CHARS - size]); size += len(text[-1])
+            if size >= SUMMARY_MAX_CHARS:
+                break
+        return "".join(text)
+
+    def summarize(self, note):
+        body = self.note_text(note['id'])
+        if not body.strip():
+            return ''
+        title = note['title'] or 'Untitled'
+        if len(body) <= SUMMARY_CHUNK_CHARS:
+            return self.ask(f"Summarize this note in 3-5 sentences.\nTitle: {title}\n\n{body}")
+        parts = [t for _, t in chunk_parts(body, SUMMARY_CHUNK_CHARS)]
+        partial = []
+        for i, text in enumerate(parts):
+            out = self.ask(f"Summarize part {i + 1} of {len(parts)} of the note \"{title}\" in 2-3 sentences.\n\n{text}")
+            if out is None:
+                return None
+            partial.append(out)
+        joined = "\n".join(f"- {p}" for p in partial)
+        return self.ask(f"Combine these summaries of consecutive parts of the note \"{title}\" into one summary of 3-5 sentences.\n\n{joined}")
+
+    def work(self, note):
+        if self.cancelled.is_set():
+            return None
+        summary = self.summarize(note)
+        if summary is None:
+            return None
+        self.notes_store.set_summary(note['folder'], note['id'], summary.strip(), note['content_hash'])
+        return summary.strip()
+
+    def run(self, on_progress=None, on_result=None, on_done=None):
+        error = None
+        try:
+            notes = self.notes_store.summary_targets(self.folder, self.note_ids)
+            todo = [n for n in notes if self.force or n['summary_hash'] != n['content_hash']]
+            self.total = len(notes); self.skipped = self.done = len(notes) - len(todo)
+            def report():
+                if on_progress:
+                    done, summarized, skipped, failed = self.done, self.summarized, self.skipped, self.failed
+                    self.dispatch(lambda: on_progress(done, self.total, summarized, skipped, failed))
+            report()
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='summarize') as pool:
+                futures = {pool.submit(self.work, n): n for n in todo}
+                for fut in as_completed(futures):
+                    note = futures[fut]
+                    if fut.cancelled():
+                        continue
+                    try:
+                        summary = fut.result()
+                    except Exception as e:
+                        summary = False; self.failed += 1; self.errors[note['id']] = e
+                    if summary is None:
+                        continue  # cancelled before it finished
+                    self.done += 1
+                    if summary is not False:
+                        self.summarized += 1
+                        if on_result:
+                            self.dispatch(lambda n=note, s=summary: on_result(n['id'], n['title'], s))
+                    report()
+                    if self.cancelled.is_set():
+                        for f in futures:
+                            f.cancel()
+        except Exception as e:
+            error = e
+        if on_done:
+            self.dispatch(lambda: on_done(self, error))
+
+# ---------------- Instrumentation ----------------
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+METRICS_LOG_BYTES = 256 * 1024
+INSTRUMENTED = {
+    'NotesStore': ('list_folders', 'create_folder', 'rename_folder', 'list_notes', 'save_note', 'update_note', 'update_chunks', 'load_note', 'read_chunk'),
+    'CommunityStore': ('list_communities', 'create_community', 'add_post', 'list_posts', 'add_message', 'list_messages'),
+    'NotesWidget': ('reload_notes',),
+    'CommunityWidget': ('reload_communities', 'open_view'),
+    'SmartaApp': ('run_search',),
+    'Autocomplete': ('lookup',),
+    'FolderSummarizer': ('summarize',),
+}
+INSTRUMENTED_FUNCS = ('read_json', 'write_json', 'atomic_write')
+
+class Metrics:
+    # Call counts, latency histograms, bytes read/written and widgets created
+    # for the store and UI hot paths. enable() wraps the targets in place and
+    # disable() restores the originals, so nothing runs while switched off.
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.originals = []
+        self.local = threading.local()  # widgets created and bytes moved, counted per thread
+
+    def record(self, name, ms, widgets=0, bytes_read=0, bytes_written=0):
+        with self.lock:
+            st = self.stats.get(name)
+            if st is None:
+                st = self.stats[name] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'hist': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                                         'bytes_read': 0, 'bytes_written': 0, 'widgets': 0}
+            st['count'] += 1; st['total_ms'] += ms; st['max_ms'] = max(st['max_ms'], ms)
+            i = 0
+            while i < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[i]:
+                i += 1
+            st['hist'][i] += 1
+            st['bytes_read'] += bytes_read; st['bytes_written'] += bytes_written; st['widgets'] += widgets
+
+    def add_bytes(self, read, written):
+        loc = self.local
+        loc.read = getattr(loc, 'read', 0) + read; loc.written = getattr(loc, 'written', 0) + written
+
+    def wrap(self, orig, name):
+        def timed(*args, **kwargs):
+            # a worker's call must not be credited with widgets the UI thread
+            # builds meanwhile; bytes come from count_io() at the storage layer
+            loc = self.local
+            w0, r0, b0 = getattr(loc, 'widgets', 0), getattr(loc, 'read', 0), getattr(loc, 'written', 0)
+            t = time.perf_counter()
+            try:
+                return orig(*args, **kwargs)
+            finally:
+                ms = (time.perf_counter() - t) * 1000
+                self.record(name, ms, getattr(loc, 'widgets', 0) - w0, getattr(loc, 'read', 0) - r0, getattr(loc, 'written', 0) - b0)
+        timed.__wrapped__ = orig
+        return timed
+
+    def enable(self):
+        if self.enabled:
+            return
+        mod = sys.modules[__name__]
+        for cls_name, methods in INSTRUMENTED.items():
+            cls = getattr(mod, cls_name)
+            for m in methods:
+                orig = cls.__dict__[m]
+                self.originals.append((cls, m, orig))
+                setattr(cls, m, self.wrap(orig, f"{cls_name}.{m}"))
+        for fn in INSTRUMENTED_FUNCS:
+            orig = getattr(mod, fn)
+            self.originals.append((mod, fn, orig))
+            setattr(mod, fn, self.wrap(orig, fn))
+        from kivy.uix.widget import Widget
+        orig_init = Widget.__init__
+        def counting_init(widget, **kwargs):
+            self.local.widgets = getattr(self.local, 'widgets', 0) + 1
+            orig_init(widget, **kwargs)
+        self.originals.append((Widget, '__init__', orig_init))
+        Widget.__init__ = counting_init
+        self.enabled = True
+
+    def disable(self):
+        for owner, attr, orig in reversed(self.originals):
+            setattr(owner, attr, orig)
+        self.originals = []
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(st, hist=list(st['hist'])) for name, st in self.stats.items()}
+
+    def report(self, limit=20):
+        rows = sorted(self.snapshot().items(), key=lambda kv: kv[1]['total_ms'], reverse=True)[:limit]
+        if not rows:
+            return 'No calls recorded yet.'
+        lines = []
+        for name, st in rows:
+            line = f"{name}: {st['count']}x avg {st['total_ms'] / st['count']:.2f} ms, max {st['max_ms']:.1f} ms"
+            if st['bytes_read'] or st['bytes_written']:
+                line += f", r {st['bytes_read'] // 1024} KiB / w {st['bytes_written'] // 1024} KiB"
+            if st['widgets']:
+                line += f", {st['widgets']} widgets"
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def write_log(self, path):
+        if self.stats:
+            append_log_line(path, {'ts': datetime.utcnow().isoformat(), 'buckets_ms': LATENCY_BUCKETS_MS,
+                                   'metrics': self.snapshot()}, METRICS_LOG_BYTES)
+
+METRICS = Metrics()
+
+# ---------------- Recycled Lists ----------------
+class PagedSource(ABC):
+    # Feeds rows (plain dicts) to a RecycledList one page at a time.
+    # fetch returns (rows, next_cursor); next_cursor is None once exhausted.
+    @abstractmethod
+    def fetch(self, cursor, limit):
+        ...
+
+class ListSource(PagedSource):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetch(self, cursor, limit):
+        start = cursor or 0
+        end = start + limit
+        return self.rows[start:end], (end if end < len(self.rows) else None)
+
+class KeysetSource(PagedSource):
+    # wraps a store method taking (before, limit) and returning rows keyed by `key`;
+    # oldest_first pages (chat) continue from their first row instead of their last
+    def __init__(self, fetch_page, key='id', oldest_first=False):
+        self.fetch_page = fetch_page; self.key = key; self.oldest_first = oldest_first
+
+    def fetch(self, cursor, limit):
+        rows = self.fetch_page(cursor, limit)
+        if len(rows) < limit:
+            return rows, None
+        return rows, rows[0][self.key] if self.oldest_first else rows[-1][self.key]
+
+class RecycledRow(RecycleDataViewBehavior):
+    # rows remember their list and index so buttons can report back to it
+    rv = None
+    index = 0
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.rv = rv; self.index = index
+        self.show(data)
+
+    def show(self, data):
+        pass
+
+    def act(self, action):
+        if self.rv is not None:
+            self.rv.row_action(self.index, action)
+
+class EmptyRow(RecycledRow, MDLabel):
+    def show(self, data):
+        self.text = data.get('text', '')
+
+class SuggestionRow(RecycledRow, MDRaisedButton):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bind(on_release=lambda x: self.act('open'))
+
+    def show(self, data):
+        self.text = data.get('topic', '')
+
+class NoteRow(RecycledRow, BoxLayout):
+    def __init__(self, **kwargs):
+        super().__init__(padding=6, **kwargs)
+        label_box = BoxLayout(orientation='vertical')
+        self.title_lbl = MDLabel(halign='left'); self.snippet_lbl = MDLabel(halign='left', theme_text_color='Secondary')
+        label_box.add_widget(self.title_lbl); label_box.add_widget(self.snippet_lbl)
+        open_btn = MDRaisedButton(text='Open', size_hint_x=None, width=80); open_btn.bind(on_release=lambda x: self.act('open'))
+        self.add_widget(label_box); self.add_widget(open_btn)
+
+    def show(self, data):
+        self.title_lbl.text = data.get('title') or data.get('created') or data.get('id', '')
+        self.snippet_lbl.text = data.get('snippet') or ''
+
+class PostRow(RecycledRow, BoxLayout):
+    def __init__(self, **kwargs):
+        super().__init__(padding=6, spacing=6, **kwargs)
+        self.thumb = Image(size_hint_x=None, width=0, opacity=0)
+        left = BoxLayout(orientation='vertical')
+        self.meta_lbl = MDLabel(theme_text_color='Secondary')
+        self.text_lbl = MDLabel(size_hint_y=None, height=50)
+        self.att_lbl = MDLabel(theme_text_color='Secondary', size_hint_y=None, height=20, shorten=True)
+        left.add_widget(self.meta_lbl); left.add_widget(self.text_lbl); left.add_widget(self.att_lbl)
+        right = BoxLayout(orientation='vertical', size_hint_x=None, width=120)
+        share = MDRaisedButton(text='Share'); share.bind(on_release=lambda x: self.act('share'))
+        right.add_widget(share)
+        self.add_widget(self.thumb); self.add_widget(left); self.add_widget(right)
+        self.preview_for = None
+
+    def show(self, data):
+        self.meta_lbl.text = f"{data.get('author', '')} • {(data.get('created') or '')[:19]}"
+        self.text_lbl.text = data.get('text') or '(no text)'
+        att = data.get('attachment')
+        self.att_name = data.get('attachment_name') or (os.path.basename(att) if att else '')
+        self.att_lbl.text = f"Attachment: {self.att_name}" if att else ''
+        self.thumb.width = 0; self.thumb.opacity = 0; self.thumb.source = ''
+        self.preview_for = att
+        previews = getattr(MDApp.get_running_app(), 'previews', None)
+        if att and previews is not None:
+            # recycled rows may have moved on by the time a preview is ready
+            ready = previews.get(att, self.att_name, lambda p, a=att: self.preview_for == a and self.show_preview(p))
+            if ready:
+                self.show_preview(ready)
+
+    def show_preview(self, preview):
+        if preview['kind'] == 'image':
+            self.thumb.source = preview['path']; self.thumb.width = 80; self.thumb.opacity = 1
+        elif preview.get('text'):
+            self.att_lbl.text = f"{self.att_name}: " + preview['text'].replace('\n', ' / ')
+
+class MessageRow(RecycledRow, MDLabel):
+    def show(self, data):
+        self.text = f"{data.get('sender', '')}: {data.get('text', '')}"
+
+class RecycledList(RecycleView):
+    # Viewport-only list: widgets exist for visible rows only and are reused
+    # while scrolling. Rows are pulled from a PagedSource as the user nears the
+    # end, so open and scroll cost depend on what is visible, not on item count.
+    # With reverse=True (chat) the list starts at the bottom and older pages
+    # are prepended as the user scrolls up.
+    def __init__(self, viewclass, row_height, action_handler=None, page_size=50, spacing=0, reverse=False, **kwargs):
+        super().__init__(**kwargs)
+        self.viewclass = viewclass; self.reverse = reverse
+        self.row_height = row_height; self.spacing_px = spacing
+        self.action_handler = action_handler; self.page_size = page_size
+        self.source = None; self.cursor = None; self.exhausted = True
+        self.layout = RecycleBoxLayout(orientation='vertical', size_hint_y=None, spacing=spacing,
+                                       default_size=(None, row_height), default_size_hint=(1, None))
+        self.layout.bind(minimum_height=self.layout.setter('height'))
+        self.add_widget(self.layout)
+        self.bind(scroll_y=self.on_scrolled)
+
+    def set_source(self, source, empty_text=None):
+        self.source = source; self.cursor = None; self.exhausted = False
+        rows = self.fetch_page()
+        if not rows and empty_text:
+            rows = [{'viewclass': EmptyRow, 'text': empty_text}]
+        self.data = rows
+        self.scroll_y = 0 if self.reverse else 1
+
+    def fetch_page(self):
+        rows, self.cursor = self.source.fetch(self.cursor, self.page_size)
+        self.exhausted = self.cursor is None
+        return list(rows)
+
+    def content_height(self, count):
+        return count * self.row_height + max(count - 1, 0) * self.spacing_px
+
+    def load_more(self):
+        if self.exhausted or self.source is None:
+            return
+        old_scrollable = max(self.content_height(len(self.data)) - self.height, 0)
+        rows = self.fetch_page()
+        if not rows:
+            return
+        # keep the rows under the finger where they were
+        if self.reverse:
+            from_bottom = self.scroll_y * old_scrollable
+            self.data = rows + list(self.data)
+        else:
+            from_top = (1 - self.scroll_y) * old_scrollable
+            self.data.extend(rows)
+        scrollable = self.content_height(len(self.data)) - self.height
+        if scrollable > 0:
+            y = from_bottom / scrollable if self.reverse else 1 - from_top / scrollable
+            self.scroll_y = max(0, min(1, y))
+
+    def push_row(self, row):
+        # a row that just became the newest: appended at the bottom of a chat
+        # (followed if the user was there), put on top otherwise
+        rows = [r for r in self.data if r.get('viewclass') is not EmptyRow]
+        if self.reverse:
+            follow = self.scroll_y <= 0.05
+            self.data = rows + [row]
+            if follow: self.scroll_y = 0
+        else:
+            self.data = [row] + rows
+
+    def on_scrolled(self, inst, value):
+        if (value >= 0.95) if self.reverse else (value <= 0.05):
+            self.load_more()
+
+    def row_action(self, index, action):
+        if self.action_handler and 0 <= index < len(self.data):
+            self.action_handler(self.data[index], action)
 
 # ---------------- UI Widgets ----------------
 class HomeWidget(BoxLayout):
@@ -180,11 +3245,9 @@ class HomeWidget(BoxLayout):
         top_bar.right_action_items = [["account-group", lambda x: self.app.switch_screen('community')]]
         self.add_widget(top_bar)
 
-        scroll = ScrollView()
-        self.feed_layout = BoxLayout(orientation='vertical', size_hint_y=None, padding=10, spacing=10)
-        self.feed_layout.bind(minimum_height=self.feed_layout.setter('height'))
-        scroll.add_widget(self.feed_layout)
-        self.add_widget(scroll)
+        self.add_widget(MDLabel(text="Suggestions", font_style="H6", size_hint_y=None, height=40, padding=(10, 0)))
+        self.feed_list = RecycledList(SuggestionRow, 56, action_handler=lambda row, action: self.app.open_ai_with_topic(row['topic']), spacing=10)
+        self.add_widget(self.feed_list)
         self.reload_suggestions()
 
         bottom = BoxLayout(size_hint_y=None, height=60, spacing=10, padding=8)
@@ -195,15 +3258,12 @@ class HomeWidget(BoxLayout):
             bottom.add_widget(b)
         self.add_widget(bottom)
 
+    def refresh(self):
+        self.reload_suggestions()
+
     def reload_suggestions(self):
-        histp = os.path.join(self.app.user_data_dir, "ai_search_history.json")
-        hist = read_json(histp, {"history": ["Photosynthesis","Human Anatomy","Nursing Basics"]})["history"]
-        self.feed_layout.clear_widgets()
-        self.feed_layout.add_widget(MDLabel(text="Suggestions", font_style="H6"))
-        for topic in hist:
-            btn = MDRaisedButton(text=topic, size_hint_y=None, height=56)
-            btn.bind(on_release=lambda inst, t=topic: self.app.open_ai_with_topic(t))
-            self.feed_layout.add_widget(btn)
+        hist = self.app.autocomplete.history() or ["Photosynthesis","Human Anatomy","Nursing Basics"]
+        self.feed_list.set_source(ListSource([{'topic': t} for t in hist]))
 
 class NotesWidget(BoxLayout):
     def __init__(self, app, notes_store, **kwargs):
@@ -222,12 +3282,16 @@ class NotesWidget(BoxLayout):
         actions = BoxLayout(size_hint_y=None, height=48, padding=6, spacing=6)
         c = MDRaisedButton(text='Create Note'); c.bind(on_release=lambda x: self.open_create_note())
         i = MDRaisedButton(text='Import Note'); i.bind(on_release=lambda x: self.open_filechooser())
-        actions.add_widget(c); actions.add_widget(i)
+        sm = MDFlatButton(text='Summarize'); sm.bind(on_release=lambda x: self.run_summarize())
+        actions.add_widget(c); actions.add_widget(i); actions.add_widget(sm)
         self.add_widget(actions)
 
-        self.notes_area = BoxLayout(orientation='vertical', size_hint_y=None, spacing=8, padding=8)
-        self.notes_area.bind(minimum_height=self.notes_area.setter('height'))
-        scroll = ScrollView(); scroll.add_widget(self.notes_area); self.add_widget(scroll)
+        self.search_input = TextInput(hint_text='Search notes and posts', multiline=False, size_hint_y=None, height=40)
+        self.search_input.bind(on_text_validate=lambda inst: self.run_local_search(inst.text))
+        self.add_widget(self.search_input)
+
+        self.notes_list = RecycledList(NoteRow, 90, action_handler=lambda row, action: self.open_row(row), spacing=8)
+        self.add_widget(self.notes_list)
         self.folder_label = MDLabel(text=f"Folder: {self.current_folder}", size_hint_y=None, height=30)
         self.add_widget(self.folder_label)
 
@@ -247,15 +3311,13 @@ class NotesWidget(BoxLayout):
         create_row = BoxLayout(size_hint_y=None, height=40)
         new_input = TextInput(hint_text='New folder name')
         create_btn = MDRaisedButton(text='Create')
-        def do_create(inst):
-            created = self.notes_store.create_folder(new_input.text)
-            if created:
+        def created(ok):
+            if ok:
                 Snackbar(text=f"Folder '{new_input.text}' created").open()
                 popup.dismiss()
-                self.reload_notes()
             else:
                 Snackbar(text='Folder exists or invalid').open()
-        create_btn.bind(on_release=do_create)
+        create_btn.bind(on_release=lambda inst: self.app.notes_async.create_folder(new_input.text, on_result=created, on_error=self.store_error))
         create_row.add_widget(new_input); create_row.add_widget(create_btn); box.add_widget(create_row)
         popup = Popup(title='Folders', content=box, size_hint=(0.9,0.9)); popup.open()
 
@@ -264,17 +3326,15 @@ class NotesWidget(BoxLayout):
         txt = TextInput(text=old_name)
         btn = MDRaisedButton(text='Rename')
         pop = Popup(title=f'Rename {old_name}', content=content, size_hint=(0.8,0.4))
-        def do_rename(inst):
-            ok = self.notes_store.rename_folder(old_name, txt.text)
+        def renamed(ok):
             if ok:
                 Snackbar(text='Folder renamed').open()
                 pop.dismiss()
                 if self.current_folder == old_name:
                     self.set_current_folder(txt.text)
-                self.reload_notes()
             else:
                 Snackbar(text='Rename failed or name exists').open()
-        btn.bind(on_release=do_rename)
+        btn.bind(on_release=lambda inst: self.app.notes_async.rename_folder(old_name, txt.text, on_result=renamed, on_error=self.store_error))
         content.add_widget(txt); content.add_widget(btn); pop.open()
 
     def set_current_folder(self, folder_name):
@@ -282,37 +3342,89 @@ class NotesWidget(BoxLayout):
         self.folder_label.text = f"Folder: {self.current_folder}"
         self.reload_notes()
 
+    def refresh(self):
+        if self.search_input.text.strip():
+            self.run_local_search(self.search_input.text)
+        else:
+            self.reload_notes()
+
     def reload_notes(self):
-        self.notes_area.clear_widgets()
-        notes = self.notes_store.list_notes(self.current_folder)
-        if not notes:
-            self.notes_area.add_widget(MDLabel(text='No notes in this folder yet.', size_hint_y=None, height=40))
+        folder = self.current_folder; self.search_ids = None
+        source = KeysetSource(lambda before, limit: self.notes_store.list_notes(folder, before=before, limit=limit))
+        self.notes_list.set_source(source, empty_text='No notes in this folder yet.')
+
+    def run_local_search(self, query):
+        index = self.notes_store.search_index
+        if not query.strip() or index is None:
+            self.reload_notes(); return
+        rows = []; seen = self.search_ids = set()
+        if not index.is_built():
+            # first run / after a restore: the app re-runs the search once the index is ready
+            self.notes_list.set_source(ListSource(rows), empty_text='Still indexing your notes - results will appear here shortly.')
             return
-        for nf in notes:
-            data = self.notes_store.load_note(self.current_folder, nf)
-            title = data.get('title') or data.get('created') or nf
-            snippet = (data.get('body') or '')[:120]
-            row = BoxLayout(size_hint_y=None, height=90, padding=6)
-            label_box = BoxLayout(orientation='vertical')
-            label_box.add_widget(MDLabel(text=title, halign='left'))
-            label_box.add_widget(MDLabel(text=snippet, halign='left', theme_text_color='Secondary'))
-            open_btn = MDRaisedButton(text='Open', size_hint_x=None, width=80); open_btn.bind(on_release=lambda inst, nf=nf: self.open_note_popup(nf))
-            row.add_widget(label_box); row.add_widget(open_btn)
-            self.notes_area.add_widget(row)
-
-    def open_note_popup(self, note_file):
-        data = self.notes_store.load_note(self.current_folder, note_file)
+        for r in index.search(query, limit=100):
+            if r['kind'] == 'note':
+                if r['ref'] in seen: continue  # large notes are indexed per piece
+                seen.add(r['ref'])
+                rows.append({'kind': 'note', 'id': r['ref'], 'title': r['title'], 'snippet': r['snippet']})
+            else:
+                rows.append({'kind': 'post', 'id': r['doc'], 'community': r['ref'], 'title': r['title'], 'snippet': r['snippet']})
+        self.notes_list.set_source(ListSource(rows), empty_text=f'No results for "{query.strip()}"')
+
+    def open_row(self, row):
+        if row.get('kind') == 'post':
+            self.app.screen('community').open_view(row['community']); return
+        folder = self.notes_store.note_folder(row['id'])
+        if folder and folder != self.current_folder:
+            self.current_folder = folder; self.folder_label.text = f"Folder: {folder}"
+        self.open_note_popup(row['id'])
+
+    def open_note_popup(self, note_id):
+        # the body is edited one stored piece (page) at a time: opening reads
+        # the first piece only and saving rewrites just the pages changed
+        folder = self.current_folder
+        info = self.notes_store.note_info(folder, note_id)
+        if not info: return
+        self.app.autocomplete.touch('n:' + note_id)
+        seqs = self.notes_store.chunk_seqs(note_id) or [0]
+        original, edited, page = {}, {}, {'i': 0}
         content = BoxLayout(orientation='vertical', spacing=8, padding=8)
-        title_input = TextInput(text=data.get('title',''), hint_text='Title')
-        body_input = TextInput(text=data.get('body',''), hint_text='Body', multiline=True)
+        title_input = TextInput(text=info.get('title',''), hint_text='Title', size_hint_y=None, height=44)
+        body_input = TextInput(hint_text='Body', multiline=True)
+        pager = BoxLayout(size_hint_y=None, height=44, spacing=6)
+        prev_btn = MDFlatButton(text='< Prev'); next_btn = MDFlatButton(text='Next >'); page_lbl = MDLabel(halign='center')
+        pager.add_widget(prev_btn); pager.add_widget(page_lbl); pager.add_widget(next_btn)
+        def keep_page():
+            seq = seqs[page['i']]
+            if body_input.text != original.get(seq): edited[seq] = body_input.text
+            else: edited.pop(seq, None)
+        def show_page(i, keep=True):
+            if keep: keep_page()
+            page['i'] = i; seq = seqs[i]
+            if seq not in original: original[seq] = self.notes_store.read_chunk(note_id, seq)
+            body_input.text = edited.get(seq, original[seq]); body_input.cursor = (0, 0)
+            page_lbl.text = f"Page {i + 1} / {len(seqs)}  ({info.get('size', 0) // 1024} KB)"
+            prev_btn.disabled = i == 0; next_btn.disabled = i == len(seqs) - 1
+        prev_btn.bind(on_release=lambda x: show_page(page['i'] - 1))
+        next_btn.bind(on_release=lambda x: show_page(page['i'] + 1))
         save_btn = MDRaisedButton(text='Save')
         pop = Popup(title='Note', content=content, size_hint=(0.9,0.9))
+        def saved(ok):
+            if ok: pop.dismiss(); return
+            # moved, deleted or its folder renamed since it was opened: keep the edits on screen
+            save_btn.disabled = False
+            Snackbar(text='Not saved: this note was moved or deleted since you opened it.').open()
         def do_save(inst):
-            path = os.path.join(self.notes_store.base, 'folders', safe_filename(self.current_folder), note_file)
-            data['title'] = title_input.text; data['body'] = body_input.text
-            write_json(path, data); pop.dismiss(); self.reload_notes()
+            keep_page(); save_btn.disabled = True
+            self.app.notes_async.update_chunks(folder, note_id, title_input.text, edited, on_result=saved,
+                                               on_error=lambda e: (setattr(save_btn, 'disabled', False), self.store_error(e)))
         save_btn.bind(on_release=do_save)
-        content.add_widget(title_input); content.add_widget(body_input); content.add_widget(save_btn); pop.open()
+        content.add_widget(title_input)
+        if info.get('summary'): content.add_widget(MDLabel(text=f"Summary: {info['summary']}", size_hint_y=None, adaptive_height=True, font_style='Caption'))
+        content.add_widget(body_input)
+        if len(seqs) > 1: content.add_widget(pager)
+        content.add_widget(save_btn)
+        show_page(0, keep=False); pop.open()
 
     def open_create_note(self):
         content = BoxLayout(orientation='vertical', spacing=8, padding=8)
@@ -320,27 +3432,84 @@ class NotesWidget(BoxLayout):
         save_btn = MDRaisedButton(text='Save')
         pop = Popup(title='Create Note', content=content, size_hint=(0.9,0.9))
         def do_save(inst):
-            self.notes_store.save_note(self.current_folder, title_input.text, body_input.text)
-            pop.dismiss(); self.reload_notes()
+            save_btn.disabled = True
+            self.app.notes_async.save_note(self.current_folder, title_input.text, body_input.text, on_result=lambda nid: pop.dismiss(),
+                                           on_error=lambda e: (setattr(save_btn, 'disabled', False), self.store_error(e)))
         save_btn.bind(on_release=do_save)
         content.add_widget(title_input); content.add_widget(body_input); content.add_widget(save_btn); pop.open()
 
+    def store_error(self, e):
+        Snackbar(text=f'Could not save: {e}').open()
+
     def open_filechooser(self):
+        # a .txt/.md file, a .zip archive, or a whole folder (selected, or the one being browsed)
         start = '/storage/emulated/0/' if platform == 'android' else os.path.expanduser('~')
-        chooser = FileChooserIconView(path=start, filters=['*.txt','*.md'])
-        popup = Popup(title='Select file to import', content=chooser, size_hint=(0.95,0.95))
-        def on_submit(inst, selection, touch):
-            if not selection: popup.dismiss(); return
-            src = selection[0]
-            try:
-                with open(src, 'r', encoding='utf-8') as f:
-                    body = f.read()
-            except Exception:
-                body = ''
-            title = os.path.basename(src)
-            self.notes_store.save_note(self.current_folder, title, body)
-            popup.dismiss(); self.reload_notes(); Snackbar(text=f'Imported {title}').open()
-        chooser.bind(on_submit=on_submit); popup.open()
+        content = BoxLayout(orientation='vertical', spacing=6)
+        chooser = FileChooserIconView(path=start, filters=['*.txt','*.md','*.zip'], dirselect=True)
+        content.add_widget(chooser)
+        row = BoxLayout(size_hint_y=None, height=48, spacing=6, padding=4)
+        sel_btn = MDRaisedButton(text='Import selected'); dir_btn = MDFlatButton(text='Import this folder')
+        row.add_widget(sel_btn); row.add_widget(dir_btn); content.add_widget(row)
+        popup = Popup(title='Select notes to import', content=content, size_hint=(0.95,0.95))
+        def start_import(src):
+            popup.dismiss(); self.run_import(src)
+        chooser.bind(on_submit=lambda inst, selection, touch: selection and start_import(selection[0]))
+        sel_btn.bind(on_release=lambda x: chooser.selection and start_import(chooser.selection[0]))
+        dir_btn.bind(on_release=lambda x: start_import(chooser.path))
+        popup.open()
+
+    def run_import(self, src):
+        from kivy.uix.progressbar import ProgressBar
+        importer = NoteImporter(self.notes_store, self.current_folder, src)
+        content = BoxLayout(orientation='vertical', spacing=8, padding=8)
+        status = MDLabel(text=f'Scanning {os.path.basename(src) or src}...')
+        bar = ProgressBar(max=1, value=0, size_hint_y=None, height=24)
+        cancel = MDRaisedButton(text='Cancel'); cancel.bind(on_release=lambda x: importer.cancel())
+        content.add_widget(status); content.add_widget(bar); content.add_widget(cancel)
+        pop = Popup(title='Importing notes', content=content, size_hint=(0.8,0.4), auto_dismiss=False); pop.open()
+        def on_progress(done, total, imported, skipped):
+            bar.max = max(total, 1); bar.value = done
+            status.text = f'{done}/{total} files - {imported} imported, {skipped} skipped'
+        def on_done(imp, error):
+            pop.dismiss()
+            if error is not None:
+                Snackbar(text=f'Import failed: {error}').open(); return
+            dupes = imp.skipped - len(imp.oversized)
+            msg = f'Imported {imp.imported} notes' + (f', skipped {dupes} duplicates' if dupes else '')
+            if imp.oversized: msg += f', {len(imp.oversized)} files over {IMPORT_MAX_BYTES // (1024 * 1024)} MB left out'
+            if imp.cancelled.is_set(): msg += ' (cancelled)'
+            Snackbar(text=msg).open()
+        importer.start(on_progress, on_done)
+
+    def run_summarize(self):
+        # the notes on screen: search results when searching, else the whole folder
+        from kivy.uix.progressbar import ProgressBar
+        ai = self.app.ai_client
+        if not ai.api_key:
+            Snackbar(text='Add openai_api_key to config.json to summarize').open(); return
+        cfg = ai.config(); ids = self.search_ids
+        job = FolderSummarizer(ai, self.notes_store, None if ids is not None else self.current_folder, note_ids=ids,
+                               workers=cfg.get('ai_batch_workers', AI_BATCH_WORKERS), rate_per_min=cfg.get('ai_rate_per_min', 60),
+                               retries=cfg.get('ai_max_retries', 4))
+        content = BoxLayout(orientation='vertical', spacing=8, padding=8)
+        status = MDLabel(text='Starting...', size_hint_y=None, height=40)
+        bar = ProgressBar(max=1, value=0, size_hint_y=None, height=24)
+        results = MDLabel(size_hint_y=None, adaptive_height=True, font_style='Caption')
+        scroll = ScrollView(); scroll.add_widget(results)
+        btn = MDRaisedButton(text='Cancel'); btn.bind(on_release=lambda x: pop.dismiss() if btn.text == 'Close' else job.cancel())
+        content.add_widget(status); content.add_widget(bar); content.add_widget(scroll); content.add_widget(btn)
+        pop = Popup(title=f"Summarizing {'search results' if ids is not None else self.current_folder}", content=content, size_hint=(0.9,0.8), auto_dismiss=False); pop.open()
+        def on_progress(done, total, summarized, skipped, failed):
+            bar.max = max(total, 1); bar.value = done
+            status.text = f'{done}/{total} notes - {summarized} summarized, {skipped} unchanged' + (f', {failed} failed' if failed else '')
+        def on_result(note_id, title, summary):
+            results.text += f"{title or 'Untitled'}:\n{summary}\n\n"
+        def on_done(job, error):
+            btn.text = 'Close'
+            if error is not None: status.text = f'Summarize failed: {error}'
+            elif job.cancelled.is_set(): status.text += ' (cancelled)'
+            elif job.errors: status.text += f' - last error: {list(job.errors.values())[-1]}'
+        job.start(on_progress, on_result, on_done)
 
 class CommunityWidget(BoxLayout):
     def __init__(self, app, community_store, **kwargs):
@@ -348,21 +3517,28 @@ class CommunityWidget(BoxLayout):
         self.app = app; self.community_store = community_store
         top = MDTopAppBar(title='Communities')
         top.left_action_items = [['plus', lambda x: self.open_create()]]
+        if app.community_sync: top.right_action_items = [['sync', lambda x: self.sync_now()]]
         self.add_widget(top)
         self.list_area = BoxLayout(orientation='vertical', size_hint_y=None, padding=10, spacing=10)
         self.list_area.bind(minimum_height=self.list_area.setter('height'))
         scroll = ScrollView(); scroll.add_widget(self.list_area); self.add_widget(scroll)
         self.reload_communities()
 
+    def refresh(self):
+        self.reload_communities()
+
     def reload_communities(self):
         self.list_area.clear_widgets()
         comms = self.community_store.list_communities()
         if not comms:
             self.list_area.add_widget(MDLabel(text='No communities yet. Create one with +'))
             return
+        sync = self.app.community_sync
         for c in comms:
             row = BoxLayout(size_hint_y=None, height=100, padding=6)
-            left = BoxLayout(orientation='vertical'); left.add_widget(MDLabel(text=c)); left.add_widget(MDLabel(text='Members: local', theme_text_color='Secondary'))
+            last = sync.last_sync(c) if sync else None
+            status = f"Synced {last[11:16]} UTC" if last else ('Not synced yet' if sync else 'Members: local')
+            left = BoxLayout(orientation='vertical'); left.add_widget(MDLabel(text=c)); left.add_widget(MDLabel(text=status, theme_text_color='Secondary'))
             row.add_widget(left)
             right = BoxLayout(orientation='vertical', size_hint_x=None, width=160)
             join = MDRaisedButton(text='Join'); join.bind(on_release=lambda inst, name=c: self.join_and_open(name))
@@ -378,11 +3554,18 @@ class CommunityWidget(BoxLayout):
         def do_create(inst):
             name = name_in.text.strip()
             if not name: Snackbar(text='Enter a name').open(); return
-            ok = self.community_store.create_community(name)
-            if ok: Snackbar(text=f"{name} created").open(); pop.dismiss(); self.reload_communities()
-            else: Snackbar(text='Already exists').open()
+            def created(ok):
+                if ok: Snackbar(text=f"{name} created").open(); pop.dismiss()
+                else: Snackbar(text='Already exists').open()
+            self.app.communities_async.create_community(name, on_result=created, on_error=self.store_error)
         create_btn.bind(on_release=do_create); pop.open()
 
+    def sync_now(self):
+        def done(stats, error):
+            if error is not None: Snackbar(text=f'Sync failed: {error}').open(); return
+            Snackbar(text=f"Synced: {stats['pulled']} new, {stats['pushed']} sent").open()
+        if self.app.run_sync(on_done=done) is None: Snackbar(text='Sync already running').open()
+
     def join_and_open(self, name):
         ensure_dir(self.community_store.community_path(name))
         Snackbar(text=f'Joined {name}').open()
@@ -392,22 +3575,8 @@ class CommunityWidget(BoxLayout):
         # View posts, add post with attachment, messages; all stored locally
         box = BoxLayout(orientation='vertical', spacing=8, padding=8)
         box.add_widget(MDLabel(text=f'Community: {name}', font_style='H6', size_hint_y=None, height=36))
-        posts_box = BoxLayout(orientation='vertical', size_hint_y=None); posts_box.bind(minimum_height=posts_box.setter('height'))
-        posts_scroll = ScrollView(size_hint=(1,0.45)); posts_scroll.add_widget(posts_box); box.add_widget(posts_scroll)
-        posts = self.community_store.list_posts(name)
-        if not posts: posts_box.add_widget(MDLabel(text='No posts yet', size_hint_y=None, height=30))
-        else:
-            for p in posts:
-                p_row = BoxLayout(size_hint_y=None, height=100, padding=6)
-                left = BoxLayout(orientation='vertical')
-                left.add_widget(MDLabel(text=f"{p['author']} • {p['created'][:19]}", theme_text_color='Secondary'))
-                left.add_widget(MDLabel(text=p.get('text','(no text)'), size_hint_y=None, height=50))
-                if p.get('attachment'):
-                    left.add_widget(MDLabel(text=f"Attachment: {os.path.basename(p['attachment'])}", theme_text_color='Secondary', size_hint_y=None, height=20))
-                p_row.add_widget(left)
-                right = BoxLayout(orientation='vertical', size_hint_x=None, width=120)
-                share = MDRaisedButton(text='Share'); share.bind(on_release=lambda inst, post=p: self.share_post(post))
-                right.add_widget(share); p_row.add_widget(right); posts_box.add_widget(p_row)
+        posts_list = RecycledList(PostRow, 100, action_handler=lambda row, action: self.share_post(row), size_hint=(1,0.45))
+        box.add_widget(posts_list)
         # create post area
         post_input = TextInput(hint_text='Write something...', size_hint_y=None, height=80)
         attach_label = MDLabel(text='No attachment', size_hint_y=None, height=20)
@@ -426,26 +3595,59 @@ class CommunityWidget(BoxLayout):
         def do_post(inst):
             txt = post_input.text.strip(); att = selected['path']
             if not (txt or att): Snackbar(text='Add text or attachment').open(); return
-            self.community_store.add_post(name, 'You', txt, att)
-            Snackbar(text='Posted').open(); pop.dismiss(); self.open_view(name)
+            def posted(post):
+                # the new post goes on top of the open list; nothing else is reloaded
+                post_btn.disabled = False; post_input.text = ''; selected['path'] = None; attach_label.text = 'No attachment'
+                posts_list.push_row(post); posts_list.scroll_y = 1
+                Snackbar(text='Posted').open()
+            def failed(e):
+                post_btn.disabled = False; self.store_error(e)
+            def publish(blob=None):
+                self.app.communities_async.add_post(name, self.app.display_name, txt, att, blob=blob, on_result=posted, on_error=failed)
+            post_btn.disabled = True
+            if not att:
+                publish(); return
+            # copy the attachment in the background; the post is written once it is stored
+            def on_progress(pct):
+                attach_label.text = f"{os.path.basename(att)} - copying {pct}%"
+            def on_error(e):
+                post_btn.disabled = False; attach_label.text = f"Attach failed: {e}"
+            self.community_store.blobs.put_async(att, lambda digest: publish(digest), on_progress, on_error)
         post_btn.bind(on_release=do_post)
         box.add_widget(post_input)
         box.add_widget(attach_btn); box.add_widget(attach_label); box.add_widget(post_btn)
         # messages
         box.add_widget(MDLabel(text='Community Chat', size_hint_y=None, height=30))
-        msgs_box = BoxLayout(orientation='vertical', size_hint_y=None); msgs_box.bind(minimum_height=msgs_box.setter('height'))
-        msgs_scroll = ScrollView(size_hint=(1,0.25)); msgs_scroll.add_widget(msgs_box); box.add_widget(msgs_scroll)
-        msgs = self.community_store.list_messages(name)
-        for m in msgs: msgs_box.add_widget(MDLabel(text=f"{m['sender']}: {m['text']}", size_hint_y=None, height=30))
+        msgs_list = RecycledList(MessageRow, 30, reverse=True, size_hint=(1,0.25))
+        box.add_widget(msgs_list)
+        def load_lists():
+            posts_list.set_source(KeysetSource(lambda cursor, limit: self.community_store.list_posts(name, cursor=cursor, limit=limit), key='seq'),
+                                  empty_text='No posts yet')
+            msgs_list.set_source(KeysetSource(lambda before, limit: self.community_store.list_messages(name, before=before, limit=limit),
+                                              key='seq', oldest_first=True))
+        load_lists()
         msg_input = TextInput(hint_text='Message', multiline=False); send = MDRaisedButton(text='Send')
         def send_msg(inst):
-            t = msg_input.text.strip(); 
+            t = msg_input.text.strip()
             if not t: return
-            self.community_store.add_message(name, 'You', t)
-            Snackbar(text='Message sent').open(); pop.dismiss(); self.open_view(name)
-        send.bind(on_release=send_msg)
+            msg_input.text = ''
+            def failed(e):
+                msg_input.text = msg_input.text or t; self.store_error(e)
+            # messages queue in order per community; each lands at the bottom of the chat when written
+            self.app.communities_async.add_message(name, self.app.display_name, t, on_result=msgs_list.push_row, on_error=failed)
+        send.bind(on_release=send_msg); msg_input.bind(on_text_validate=send_msg)
         box.add_widget(msg_input); box.add_widget(send)
-        pop = Popup(title=f'Community: {name}', content=box, size_hint=(0.95,0.95)); pop.open()
+        pop = Popup(title=f'Community: {name}', content=box, size_hint=(0.95,0.95))
+        self.open_community = (name, load_lists)
+        pop.bind(on_dismiss=lambda x: setattr(self, 'open_community', None)); pop.open()
+
+    def reload_view(self, name):
+        # after a sync: the open view's lists restart from the newest page
+        if getattr(self, 'open_community', None) and self.open_community[0] == name:
+            self.open_community[1]()
+
+    def store_error(self, e):
+        Snackbar(text=f'Could not save: {e}').open()
 
     def share_post(self, post):
         # placeholder share: show path and text
@@ -461,8 +3663,95 @@ class ProfileWidget(BoxLayout):
         super().__init__(orientation='vertical', **kwargs)
         self.app = app
         self.add_widget(MDTopAppBar(title='Profile'))
-        self.add_widget(MDLabel(text='Smarta - profile/settings', halign='left'))
-        self.add_widget(MDLabel(text='Theme: Butter (default)', halign='left'))
+        self.add_widget(MDLabel(text='Smarta - profile/settings', halign='left', size_hint_y=None, height=40))
+        self.add_widget(MDLabel(text='Theme: Butter (default)', halign='left', size_hint_y=None, height=40))
+        # diagnostics: store/UI timings recorded while enabled
+        self.add_widget(MDLabel(text='Diagnostics', font_style='H6', size_hint_y=None, height=40))
+        actions = BoxLayout(size_hint_y=None, height=48, spacing=6)
+        self.diag_toggle = MDRaisedButton(); self.diag_toggle.bind(on_release=lambda x: self.toggle_diagnostics())
+        refresh = MDFlatButton(text='Refresh'); refresh.bind(on_release=lambda x: self.refresh_diagnostics())
+        reset = MDFlatButton(text='Reset'); reset.bind(on_release=lambda x: (METRICS.reset(), self.refresh_diagnostics()))
+        actions.add_widget(self.diag_toggle); actions.add_widget(refresh); actions.add_widget(reset)
+        self.add_widget(actions)
+        self.diag_label = MDLabel(size_hint_y=None, adaptive_height=True, font_style='Caption')
+        scroll = ScrollView(); scroll.add_widget(self.diag_label); self.add_widget(scroll)
+        # backups: incremental archives of the data dir (config.json: backup_dir, backup_keep)
+        self.add_widget(MDLabel(text='Backup', font_style='H6', size_hint_y=None, height=40))
+        actions = BoxLayout(size_hint_y=None, height=48, spacing=6)
+        for text, fn in (('Back up now', self.run_backup), ('Verify', self.run_verify), ('Restore latest', self.confirm_restore)):
+            b = MDFlatButton(text=text); b.bind(on_release=lambda x, fn=fn: fn()); actions.add_widget(b)
+        self.backup_cancel = MDFlatButton(text='Cancel', disabled=True); self.backup_cancel.bind(on_release=lambda x: self.app.backups.cancel())
+        actions.add_widget(self.backup_cancel); self.add_widget(actions)
+        self.backup_label = MDLabel(size_hint_y=None, height=40, font_style='Caption'); self.add_widget(self.backup_label)
+        self.refresh_diagnostics(); self.refresh_backup_status()
+
+    def toggle_diagnostics(self):
+        METRICS.disable() if METRICS.enabled else METRICS.enable()
+        self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        self.diag_toggle.text = 'Disable diagnostics' if METRICS.enabled else 'Enable diagnostics'
+        cache = self.app.ai_cache.stats()
+        text = f"AI cache: {cache['hits']} hits / {cache['misses']} misses, {cache['entries']} entries, {cache['bytes'] // 1024} KiB\n"
+        text += METRICS.report() if METRICS.enabled or METRICS.stats else 'Diagnostics are off.'
+        self.diag_label.text = text
+
+    def refresh_backup_status(self):
+        latest = self.app.backups.latest()
+        self.backup_label.text = f"Last backup: {latest['created'][:16].replace('T', ' ')} UTC, {len(latest['files'])} files" if latest else 'No backups yet.'
+
+    def backup_task(self, label, fn, *args, on_result=None):
+        if self.app.backups.busy.locked():
+            Snackbar(text='A backup task is already running').open(); return
+        self.backup_cancel.disabled = False; self.backup_label.text = f'{label}...'
+        def on_progress(pct):
+            self.backup_label.text = f'{label}... {pct}%'
+        def on_done(res, err):
+            self.backup_cancel.disabled = True; self.refresh_backup_status()
+            if err is not None: Snackbar(text=f'{label} failed: {err}').open()
+            elif on_result: on_result(res)
+        self.app.backups.start(fn, *args, on_progress=on_progress, on_done=on_done)
+
+    def run_backup(self):
+        keep = read_json(os.path.join(self.app.user_data_dir, 'config.json'), {}).get('backup_keep', 10)
+        def done(m):
+            self.app.backups.prune(keep); Snackbar(text=f"Backup done, {m['archived']} changed files archived").open()
+        self.backup_task('Backing up', self.app.backups.backup, on_result=done)
+
+    def run_verify(self):
+        if self.app.backups.latest() is None:
+            Snackbar(text='No backups yet').open(); return
+        def done(problems):
+            Snackbar(text=f'Backup damaged: {problems[0]}' if problems else 'Backup verified').open()
+        self.backup_task('Verifying', self.app.backups.verify, on_result=done)
+
+    def confirm_restore(self):
+        latest = self.app.backups.latest()
+        if latest is None:
+            Snackbar(text='No backups yet').open(); return
+        content = BoxLayout(orientation='vertical', spacing=8, padding=8)
+        content.add_widget(MDLabel(text=f"Replace all notes, communities and settings with the backup from {latest['created'][:16].replace('T', ' ')} UTC? Smarta applies it on the next start."))
+        ok = MDRaisedButton(text='Restore'); content.add_widget(ok)
+        pop = Popup(title='Restore backup', content=content, size_hint=(0.8,0.4))
+        def do_restore(inst):
+            pop.dismiss()
+            self.backup_task('Restoring', self.app.backups.stage_restore, latest['id'],
+                             on_result=lambda m: Snackbar(text='Restore ready - restart Smarta to apply').open())
+        ok.bind(on_release=do_restore); pop.open()
+
+    def refresh(self):
+        self.refresh_diagnostics()
+
+# store events -> screens that display the changed data
+SCREEN_EVENTS = {
+    'note_saved': ('notes',),
+    'folder_created': ('notes',),
+    'folder_renamed': ('notes',),
+    'community_created': ('community',),
+    'posts_synced': ('community',),
+    'messages_synced': ('community',),
+    'search_ready': ('notes',),
+}
 
 class SmartaApp(MDApp):
     def build(self):
@@ -472,39 +3761,144 @@ class SmartaApp(MDApp):
         data_dir = self.user_data_dir
         ensure_dir(data_dir)
         self.user_data_dir = data_dir  # safe because we only read and reassign same value locally (works on most platforms)
-        self.notes_store = NotesStore(data_dir)
-        self.community_store = CommunityStore(data_dir)
-        # root layout
+        self.init_stores(data_dir)
+        if read_json(os.path.join(data_dir, 'config.json'), {}).get('diagnostics'):
+            METRICS.enable()
+        Clock.schedule_interval(lambda dt: METRICS.enabled and METRICS.write_log(self.metrics_log_path()), 60)
+        Clock.schedule_once(lambda dt: self.community_store.blobs.executor.submit(self.community_store.collect_garbage), 10)
+        if self.community_sync:
+            interval = read_json(os.path.join(data_dir, 'config.json'), {}).get('sync_interval', 300)
+            Clock.schedule_once(lambda dt: self.run_sync(), 5)
+            Clock.schedule_interval(lambda dt: self.run_sync(), interval)
+        self.notes_store.subscribe(self.on_store_event)
+        self.community_store.subscribe(self.on_store_event)
+        self.notes_async = AsyncStore(self.notes_store, self.io, lambda name, args: 'notes')
+        # calls that rewrite the shared community index run on one queue
+        self.communities_async = AsyncStore(self.community_store, self.io,
+                                            lambda name, args: ('community', args[0]) if args and name not in COMMUNITY_INDEX_CALLS else 'communities')
+        # root layout; screens are built on first visit
         self.root_box = BoxLayout(orientation='vertical')
-        self.home_w = HomeWidget(self)
-        self.notes_w = NotesWidget(self, self.notes_store)
-        self.community_w = CommunityWidget(self, self.community_store)
-        self.profile_w = ProfileWidget(self)
-        self.ai_w = self.build_ai_widget()
+        self.screen_factories = {
+            'home': lambda: HomeWidget(self),
+            'notes': lambda: NotesWidget(self, self.notes_store),
+            'ai': self.build_ai_widget,
+            'community': lambda: CommunityWidget(self, self.community_store),
+            'profile': lambda: ProfileWidget(self),
+        }
+        self.screens = {}; self.dirty = set(); self.current_name = None
         self.current_widget = None
         self.switch_screen('home')
         return self.root_box
 
+    def init_stores(self, data_dir):
+        # everything the UI needs from disk; also run by the headless profiler
+        # UI-initiated store writes and first-run indexing run here; one ordered queue for notes, one per community
+        self.io = IOExecutor()
+        cfg = read_json(os.path.join(data_dir, 'config.json'), {})
+        if apply_staged_restore(data_dir, cfg.get('backup_dir')):
+            cfg = read_json(os.path.join(data_dir, 'config.json'), {})
+        self.backups = BackupEngine(data_dir, cfg.get('backup_dir'))
+        with PROFILER.phase('store:ai_cache'):
+            self.ai_cache = ResponseCache(os.path.join(data_dir, 'ai_cache.db'), ttl=cfg.get('ai_cache_ttl', 7 * 24 * 3600),
+                                          max_bytes=cfg.get('ai_cache_max_bytes', 5 * 1024 * 1024))
+            self.ai_client = AIClient(os.path.join(data_dir, 'config.json'), cache=self.ai_cache)
+        with PROFILER.phase('store:previews'):
+            self.previews = PreviewCache(os.path.join(data_dir, 'previews'))
+        with PROFILER.phase('store:search_index'):
+            self.search_index = open_search_index(os.path.join(data_dir, 'search.db'))
+        with PROFILER.phase('store:autocomplete'):
+            self.autocomplete = Autocomplete(os.path.join(data_dir, 'autocomplete.db'))
+        with PROFILER.phase('store:notes'):
+            self.notes_store = NotesStore(data_dir, search_index=self.search_index, autocomplete=self.autocomplete)
+        with PROFILER.phase('store:communities'):
+            self.community_store = CommunityStore(data_dir, search_index=self.search_index)
+        # optional relay for sharing communities between devices (see relay.py)
+        self.community_sync = CommunitySync(self.community_store, cfg['sync_relay_url']) if cfg.get('sync_relay_url') else None
+        self.display_name = cfg.get('display_name') or 'You'
+        if not self.search_index.is_built():
+            # first run / upgrade / restore: index in the background, local search says so meanwhile
+            self.io.submit('search', self.search_index.rebuild, self.notes_store, self.community_store,
+                           on_result=lambda done: done and self.on_store_event('search_ready'))
+        if not self.autocomplete.get_flag('seeded'):
+            # first run / upgrade: titles are seeded in the background, lookups pick them up as they land
+            self.io.submit('autocomplete', self.autocomplete.seed,
+                           ((n['id'], n['title'], n['created']) for n in self.notes_store.iter_notes(bodies=False)),
+                           os.path.join(data_dir, 'ai_search_history.json'))
+
+    def screen(self, name):
+        w = self.screens.get(name)
+        if w is None:
+            with PROFILER.phase(f'screen:{name}'):
+                w = self.screens[name] = self.screen_factories[name]()
+            self.dirty.discard(name)
+        return w
+
+    def on_store_event(self, event, **info):
+        # stores emit on whichever thread wrote (IOExecutor, import, sync):
+        # screens and self.dirty are only touched on the UI thread
+        Clock.schedule_once(lambda dt: self.handle_store_event(event, **info), 0)
+
+    def handle_store_event(self, event, **info):
+        for name in SCREEN_EVENTS.get(event, ()):
+            self.invalidate(name)
+        if event in ('posts_synced', 'messages_synced') and 'community' in self.screens:
+            # merged records can shift seqs under the open lists' keyset cursors
+            self.screens['community'].reload_view(info['community'])
+
+    def invalidate(self, name):
+        # screens not built yet will read fresh data when they are; the visible
+        # screen refreshes on the next frame, the others on their next visit
+        if name not in self.screens:
+            return
+        if name == self.current_name:
+            Clock.schedule_once(lambda dt: self.refresh_screen(name), 0)
+        else:
+            self.dirty.add(name)
+
+    def refresh_screen(self, name):
+        self.dirty.discard(name)
+        w = self.screens.get(name)
+        if w is not None and hasattr(w, 'refresh'):
+            w.refresh()
+
     def build_ai_widget(self):
         box = BoxLayout(orientation='vertical', padding=10, spacing=10)
         box.add_widget(MDTopAppBar(title='AI'))
         self.ai_search = MDTextField(hint_text='Ask AI (summary/detailed)...', size_hint_x=0.95)
         box.add_widget(self.ai_search)
+        # live suggestions from history and note titles, updated per keystroke
+        self.ai_suggest = RecycledList(SuggestionRow, 44, action_handler=lambda row, action: self.pick_suggestion(row),
+                                       page_size=8, spacing=4, size_hint_y=None, height=0)
+        box.add_widget(self.ai_suggest)
+        self.ai_search.bind(text=lambda inst, text: self.show_suggestions(self.autocomplete.lookup(text) if text.strip() else []))
         sb = MDRaisedButton(text='Search'); sb.bind(on_release=lambda x: self.run_search())
         box.add_widget(sb)
         self.ai_results = BoxLayout(orientation='vertical', size_hint_y=None); self.ai_results.bind(minimum_height=self.ai_results.setter('height'))
         scroll = ScrollView(); scroll.add_widget(self.ai_results); box.add_widget(scroll)
         return box
 
+    def show_suggestions(self, rows):
+        if not hasattr(self, 'ai_suggest'):
+            return
+        if rows and rows[0]['topic'] == self.ai_search.text.strip():
+            rows = rows[1:]
+        self.ai_suggest.height = min(len(rows), 4) * 48
+        self.ai_suggest.set_source(ListSource(rows))
+
+    def pick_suggestion(self, row):
+        if row.get('kind') == 'note':
+            self.autocomplete.touch(row['eid'])
+        self.ai_search.text = row['topic']
+        self.run_search()
+
     def run_search(self):
         topic = self.ai_search.text.strip() if hasattr(self, 'ai_search') else ''
         if not topic:
             Snackbar(text='Type a query').open(); return
         # save to history
-        histp = os.path.join(self.user_data_dir, 'ai_search_history.json')
-        hist = read_json(histp, {'history': []})
-        if topic not in hist['history']:
-            hist['history'].insert(0, topic); hist['history'] = hist['history'][:50]; write_json(histp, hist)
+        self.autocomplete.record_query(topic)
+        self.invalidate('home')
+        self.show_suggestions([])
         # display placeholder summary
         self.ai_results.clear_widgets()
         self.ai_results.add_widget(MDLabel(text=f"Summary for: {topic}\n(Placeholder)", size_hint_y=None, height=120))
@@ -512,24 +3906,32 @@ class SmartaApp(MDApp):
         ad = MDRaisedButton(text='Detailed Explanation (Watch Ad)')
         ad.bind(on_release=lambda x: self.show_ad_placeholder('Watch an ad to unlock detailed explanation (placeholder)'))
         self.ai_results.add_widget(ad)
-        # if API key present in config.json, attempt to call OpenAI (user must add key to config)
-        cfgp = os.path.join(self.user_data_dir, 'config.json')
-        cfg = read_json(cfgp, {})
-        api_key = cfg.get('openai_api_key')
-        if api_key:
-            try:
-                # safe minimal request to OpenAI Chat Completions (user supplies key)
-                headers = {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
-                body = {'model':'gpt-3.5-turbo','messages':[{'role':'user','content':f'Summarize: {topic}'}], 'max_tokens':150}
-                resp = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=body, timeout=10)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    text = data['choices'][0]['message']['content']
-                    self.ai_results.add_widget(MDLabel(text=f"AI: {text}", size_hint_y=None, height=200))
-                else:
-                    self.ai_results.add_widget(MDLabel(text=f"AI request failed (status {resp.status_code})", size_hint_y=None, height=40))
-            except Exception as e:
-                self.ai_results.add_widget(MDLabel(text=f"AI request error: {e}", size_hint_y=None, height=40))
+        # if API key present in config.json, ask the AI off the UI thread (user must add key to config)
+        if self.ai_client.api_key:
+            status = MDLabel(text='AI: thinking...', size_hint_y=None, adaptive_height=True)
+            self.ai_results.add_widget(status)
+            def on_error(e):
+                status.text = str(e) if isinstance(e, AIError) else f"AI request error: {e}"
+            if self.ai_client.config().get('ai_stream', True):
+                received = []
+                def on_delta(text):
+                    received.append(text); status.text = "AI: " + ''.join(received)
+                self.ai_client.stream(f'Summarize: {topic}', on_delta, on_error=on_error)
+            else:
+                def on_result(text):
+                    status.text = f"AI: {text}"
+                self.ai_client.submit(f'Summarize: {topic}', on_result, on_error)
+        else:
+            # no key: still show a previously cached answer, offline
+            self.ai_client.cancel()
+            hit = self.ai_client.cached(f'Summarize: {topic}')
+            if hit is not None:
+                self.ai_results.add_widget(MDLabel(text=f"AI: {hit}", size_hint_y=None, height=200))
+
+    def open_ai_with_topic(self, topic):
+        self.switch_screen('ai')
+        self.ai_search.text = topic
+        self.run_search()
 
     def show_ad_placeholder(self, msg):
         content = BoxLayout(orientation='vertical', spacing=8, padding=8)
@@ -538,17 +3940,69 @@ class SmartaApp(MDApp):
         content.add_widget(close)
         pop = Popup(title='Rewarded Ad (placeholder)', content=content, size_hint=(0.8,0.4)); pop.open()
 
+    def on_start(self):
+        from kivy.core.window import Window
+        def first_frame(*args):
+            Window.unbind(on_flip=first_frame)
+            PROFILER.mark('first_frame')
+            PROFILER.finish(os.path.join(self.user_data_dir, 'startup.log'))
+            if '--profile-startup' in sys.argv:
+                print(PROFILER.report()); self.stop()
+        Window.bind(on_flip=first_frame)
+
+    def on_pause(self):
+        # completed writes now; queued ones flush when they finish, without blocking the UI thread
+        flush_writes()
+        self.io.when_idle(flush_writes)
+        return True
+
+    def run_sync(self, communities=None, on_done=None):
+        # background sync round; the store events refresh the community screen
+        def done(stats, error):
+            if error is None: self.invalidate('community')
+            if on_done: on_done(stats, error)
+        return self.community_sync.start(communities, on_done=done) if self.community_sync else None
+
+    def metrics_log_path(self):
+        return os.path.join(self.user_data_dir, 'metrics.log')
+
+    def on_stop(self):
+        if METRICS.enabled:
+            METRICS.write_log(self.metrics_log_path())
+        self.backups.cancel()
+        self.search_index.cancel()
+        self.io.shutdown()
+        flush_writes()
+        self.ai_client.close()
+        if self.community_sync: self.community_sync.close()
+
     def switch_screen(self, name):
         if self.current_widget:
             try: self.root_box.remove_widget(self.current_widget)
             except Exception: pass
-        if name == 'home': self.current_widget = self.home_w
-        elif name == 'notes': self.notes_w.reload_notes(); self.current_widget = self.notes_w
-        elif name == 'ai': self.current_widget = self.ai_w
-        elif name == 'community': self.community_w.reload_communities(); self.current_widget = self.community_w
-        elif name == 'profile': self.current_widget = self.profile_w
+        if name in self.screen_factories:
+            self.current_widget = self.screen(name)
+            if name in self.dirty: self.refresh_screen(name)
         else: self.current_widget = MDLabel(text=f'Unknown: {name}')
+        self.current_name = name
         self.root_box.add_widget(self.current_widget)
 
+def profile_headless():
+    # times imports and store initialisation without opening a window; point
+    # SMARTA_DATA_DIR at a real data dir to profile against existing data
+    data_dir = os.environ.get('SMARTA_DATA_DIR') or tempfile.mkdtemp(prefix='smarta-profile-')
+    ensure_dir(data_dir)
+    app = SmartaApp()
+    PROFILER.mark('app_init')
+    app.init_stores(data_dir)
+    PROFILER.finish(os.path.join(data_dir, 'startup.log'))
+    print(PROFILER.report())
+    app.search_index.cancel()
+    app.io.shutdown()
+    app.ai_client.close()
+
 if __name__ == '__main__':
-    SmartaApp().run()
+    if '--profile-startup' in sys.argv and '--headless' in sys.argv:
+        profile_headless()
+    else:
+        SmartaApp().run()
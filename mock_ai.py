@@ -0,0 +1,155 @@
+# mock_ai.py - Smarta - local stand-in for the chat-completions endpoint
+#
+#   python mock_ai.py --port 8766 --fail-rate 0.2 --latency 0.3
+#       then in config.json: "openai_endpoint": "http://127.0.0.1:8766/v1/chat/completions",
+#                            "openai_api_key": "test"
+#   python mock_ai.py --demo --notes 40     # run the folder summarizer against it and exit
+#
+# Answers with a short deterministic "summary" of the prompt (plain JSON, or
+# server-sent events when the request has "stream": true). --fail-rate makes
+# that share of requests fail with 429 (with Retry-After) or 503, and
+# --rpm answers 429 once more than that many requests arrive in a minute,
+# so retries, backoff and pacing can be exercised without a real API.
+import os
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def fake_summary(prompt, words=12):
+    # the first words of the prompt's payload (after the instruction line(s))
+    body = prompt.split("\n\n", 1)[-1]
+    return "Summary: " + " ".join(body.split()[:words])
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        srv = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with srv.lock:
+            srv.stats["requests"] += 1
+            now = time.monotonic(); srv.recent.append(now)
+            while srv.recent and srv.recent[0] < now - 60:
+                srv.recent.popleft()
+            limited = srv.rpm and len(srv.recent) > srv.rpm
+            fail = srv.rng.random() < srv.fail_rate
+        if srv.latency:
+            time.sleep(srv.latency * srv.rng.uniform(0.5, 1.5))
+        if limited or fail:
+            status = 429 if limited or srv.rng.random() < 0.5 else 503
+            with srv.lock:
+                srv.stats[str(status)] += 1
+            return self.reply(status, {"error": {"message": "mock failure"}}, {"Retry-After": "1"} if status == 429 else {})
+        try:
+            req = json.loads(body)
+            prompt = req["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            return self.reply(400, {"error": {"message": "bad request"}})
+        text = fake_summary(prompt)
+        with srv.lock:
+            srv.stats["200"] += 1
+        if req.get("stream"):
+            events = [{"choices": [{"delta": {"content": w + " "}}]} for w in text.split()]
+            data = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+            return self.send(200, data.encode("utf-8"), "text/event-stream")
+        self.reply(200, {"choices": [{"message": {"role": "assistant", "content": text}}]})
+
+    def reply(self, status, doc, headers=None):
+        self.send(status, json.dumps(doc).encode("utf-8"), "application/json", headers)
+
+    def send(self, status, data, ctype, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+def serve(host="127.0.0.1", port=8766, fail_rate=0.0, latency=0.0, rpm=0, verbose=False, seed=None):
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.fail_rate = fail_rate; server.latency = latency; server.rpm = rpm; server.verbose = verbose
+    server.rng = random.Random(seed); server.lock = threading.Lock(); server.recent = deque()
+    server.stats = {"requests": 0, "200": 0, "429": 0, "503": 0}
+    return server
+
+def demo(args):
+    # a temp data dir with short and long notes, summarized twice: the second
+    # run must skip everything, since no note changed in between
+    import main
+    server = serve(port=0, fail_rate=args.fail_rate, latency=args.latency, rpm=args.rpm, seed=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    work = tempfile.mkdtemp(prefix="smarta-mock-ai-")
+    try:
+        cfg = os.path.join(work, "config.json")
+        main.write_json(cfg, {"openai_api_key": "test", "openai_endpoint": f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"}, sync=True)
+        ai = main.AIClient(cfg, cache=main.ResponseCache(os.path.join(work, "ai_cache.db")))
+        notes = main.NotesStore(work)
+        rng = random.Random(3)
+        words = "cell membrane protein energy heart blood lung enzyme vitamin dosage clinical theory".split()
+        for i in range(args.notes):
+            size = 30_000 if i % 10 == 0 else 400  # every tenth note needs chunking
+            body = " ".join(rng.choice(words) for _ in range(size // 6))
+            notes.save_note("Default", f"Note {i}", body)
+        direct = lambda fn: fn()
+        def run(label, **kw):
+            job = main.FolderSummarizer(ai, notes, "Default", workers=args.workers, rate_per_min=args.rate,
+                                        burst=args.workers, backoff=0.2, dispatch=direct, **kw)
+            t = time.perf_counter(); job.run()
+            print(f"{label}: {job.summarized} summarized, {job.skipped} skipped, {job.failed} failed, "
+                  f"{job.requests} requests ({job.retried} retried) in {time.perf_counter() - t:.2f}s")
+            return job
+        first = run("first run")
+        second = run("second run")
+        note = notes.list_notes("Default", limit=1)[0]
+        notes.update_note("Default", note["id"], note["title"], "changed body " * 50)
+        third = run("after one edit")
+        print(f"mock server: {server.stats}")
+        ok = first.summarized + first.failed == args.notes and second.summarized == 0 and third.summarized == 1
+        print("ok" if ok else "UNEXPECTED COUNTS")
+        ai.close()
+        return 0 if ok else 1
+    finally:
+        server.shutdown()
+        main.flush_writes()
+        shutil.rmtree(work, ignore_errors=True)
+
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description="Mock chat-completions endpoint for Smarta")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 429/503")
+    ap.add_argument("--latency", type=float, default=0.0, help="mean seconds per response")
+    ap.add_argument("--rpm", type=int, default=0, help="answer 429 above this many requests per minute (0 = off)")
+    ap.add_argument("--verbose", action="store_true", help="log every request")
+    ap.add_argument("--demo", action="store_true", help="summarize a generated folder against the mock and exit")
+    ap.add_argument("--notes", type=int, default=30, help="notes in the demo folder")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--rate", type=float, default=600, help="demo client rate limit, requests per minute")
+    args = ap.parse_args(argv)
+    if args.demo:
+        return demo(args)
+    server = serve(args.host, args.port, args.fail_rate, args.latency, args.rpm, args.verbose)
+    print(f"mock AI on http://{args.host}:{server.server_address[1]}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,214 @@
+# relay.py - Smarta - reference relay for community sync (main.CommunitySync)
+#
+#   python relay.py --port 8765                      # in-memory relay
+#   python relay.py --port 8765 --data relay.jsonl   # keep records across restarts
+#   python relay.py --simulate --clients 4 --messages 500
+#
+# Protocol: POST /sync with a (gzip) JSON body
+#   {"device": d, "community": c,
+#    "streams": {"posts": {"cursor": n, "limit": n, "push": [...]}, "messages": {...}}}
+# Per stream the relay appends pushed records that continue the device's
+# dseq run (duplicates are dropped, a gap stops the push), numbers them with
+# its own rseq, and answers with up to `limit` records of other devices after
+# `cursor`: {"records": [...], "cursor": n, "more": bool, "acked": n}.
+# `acked` is the highest dseq of the caller the relay holds. The relay never
+# reorders anything - clients sort merged records by (lc, dev, dseq).
+import os
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STREAMS = ("posts", "messages")
+
+class RelayStore:
+    # records per (community, stream) in arrival order plus each device's
+    # highest accepted dseq; optionally appended to a JSON Lines file
+    def __init__(self, data_path=None):
+        self.lock = threading.Lock()
+        self.logs = {}; self.heads = {}
+        self.data_path = data_path
+        self.bytes_in = self.bytes_in_raw = self.bytes_out = self.bytes_out_raw = 0
+        if data_path and os.path.exists(data_path):
+            with open(data_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+                    self.accept(e["c"], e["s"], e["r"])
+        self.out = open(data_path, "a", encoding="utf-8") if data_path else None
+
+    def accept(self, community, stream, rec):
+        key = (community, stream)
+        log = self.logs.setdefault(key, []); heads = self.heads.setdefault(key, {})
+        if rec["dseq"] != heads.get(rec["dev"], 0) + 1:
+            return False
+        heads[rec["dev"]] = rec["dseq"]
+        log.append(dict(rec, rseq=len(log) + 1))
+        return True
+
+    def exchange(self, device, community, streams):
+        out = {}
+        with self.lock:
+            for name in STREAMS:
+                req = streams.get(name) or {}
+                key = (community, name)
+                for rec in sorted(req.get("push", ()), key=lambda r: r["dseq"]):
+                    if rec.get("dev") != device:
+                        continue  # devices only publish their own records
+                    if rec["dseq"] <= self.heads.get(key, {}).get(device, 0):
+                        continue
+                    if not self.accept(community, name, rec):
+                        break
+                    if self.out:
+                        self.out.write(json.dumps({"c": community, "s": name, "r": rec}, separators=(",", ":")) + "\n")
+                log = self.logs.get(key, [])
+                cursor = max(0, int(req.get("cursor", 0))); limit = max(1, int(req.get("limit", 500)))
+                records = []
+                while cursor < len(log) and len(records) < limit:
+                    rec = log[cursor]; cursor += 1
+                    if rec["dev"] != device:
+                        records.append(rec)
+                out[name] = {"records": records, "cursor": cursor, "more": cursor < len(log),
+                             "acked": self.heads.get(key, {}).get(device, 0)}
+            if self.out:
+                self.out.flush()
+        return out
+
+    def close(self):
+        if self.out:
+            self.out.close()
+
+class RelayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path != "/sync":
+            return self.reply(404, {"error": "not found"})
+        store = self.server.store
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            raw = gzip.decompress(body) if self.headers.get("Content-Encoding") == "gzip" else body
+            req = json.loads(raw)
+            resp = {"streams": store.exchange(req["device"], req["community"], req.get("streams", {}))}
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            return self.reply(400, {"error": str(e)})
+        store.bytes_in += len(body); store.bytes_in_raw += len(raw)
+        self.reply(200, resp)
+
+    def reply(self, status, doc):
+        data = json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        raw = len(data)
+        gz = "gzip" in self.headers.get("Accept-Encoding", "")
+        if gz:
+            data = gzip.compress(data, 6)
+        self.server.store.bytes_out += len(data); self.server.store.bytes_out_raw += raw
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+def serve(host="127.0.0.1", port=8765, data_path=None, verbose=False):
+    server = ThreadingHTTPServer((host, port), RelayHandler)
+    server.daemon_threads = True
+    server.store = RelayStore(data_path); server.verbose = verbose
+    return server
+
+def simulate(clients, messages, posts, rounds_between=50, seed=7):
+    # N stores in temp dirs talk to one in-process relay: everyone writes and
+    # syncs interleaved, then syncs until quiet; every client must end up with
+    # the same records in the same order
+    import main
+    rng = random.Random(seed)
+    server = serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/sync"
+    work = tempfile.mkdtemp(prefix="smarta-relay-")
+    try:
+        peers = []
+        for i in range(clients):
+            store = main.CommunityStore(os.path.join(work, f"client{i}"))
+            store.create_community("Lobby")
+            peers.append(main.CommunitySync(store, url))
+        t = time.perf_counter()
+        pending = [(p, "m") for p in peers for _ in range(messages)] + [(p, "p") for p in peers for _ in range(posts)]
+        rng.shuffle(pending)
+        for i, (peer, kind) in enumerate(pending):
+            who = peer.store.device[:6]
+            if kind == "m":
+                peer.store.add_message("Lobby", who, f"message {i} from {who}")
+            else:
+                peer.store.add_post("Lobby", who, f"post {i} from {who}")
+            if i % rounds_between == 0:
+                rng.choice(peers).sync("Lobby")
+        rounds = 0
+        while True:
+            rounds += 1
+            moved = 0
+            for peer in peers:
+                stats = peer.sync("Lobby")
+                moved += stats["pushed"] + stats["pulled"]
+            if not moved:
+                break
+        elapsed = time.perf_counter() - t
+        main.flush_writes()
+        orders = [[(r["dev"], r["dseq"]) for r in p.store.message_log("Lobby")] for p in peers]
+        post_orders = [[(r["dev"], r["dseq"]) for r in p.store.post_log("Lobby")] for p in peers]
+        converged = all(o == orders[0] for o in orders) and all(o == post_orders[0] for o in post_orders)
+        expected = clients * messages
+        store = server.store
+        delivered = (clients - 1) * clients * (messages + posts)
+        print(f"clients: {clients}, records written: {clients * (messages + posts)}, settle rounds: {rounds}")
+        print(f"messages per client: {len(orders[0])} (expected {expected}), posts: {len(post_orders[0])}")
+        print(f"converged: {'yes' if converged and len(orders[0]) == expected else 'NO'}")
+        print(f"time: {elapsed:.2f}s, {delivered / elapsed:,.0f} records delivered/s")
+        print(f"upload: {store.bytes_in:,} B gzip / {store.bytes_in_raw:,} B raw; "
+              f"download: {store.bytes_out:,} B gzip / {store.bytes_out_raw:,} B raw")
+        for p in peers:
+            p.close()
+        return 0 if converged and len(orders[0]) == expected else 1
+    finally:
+        server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description="Smarta community sync relay")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--data", help="JSON Lines file to persist records in")
+    ap.add_argument("--verbose", action="store_true", help="log every request")
+    ap.add_argument("--simulate", action="store_true", help="run a multi-client convergence test and exit")
+    ap.add_argument("--clients", type=int, default=3)
+    ap.add_argument("--messages", type=int, default=200, help="messages per simulated client")
+    ap.add_argument("--posts", type=int, default=20, help="posts per simulated client")
+    args = ap.parse_args(argv)
+    if args.simulate:
+        return simulate(args.clients, args.messages, args.posts)
+    server = serve(args.host, args.port, args.data, args.verbose)
+    print(f"relay on http://{args.host}:{server.server_address[1]}/sync - set sync_relay_url in config.json")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())